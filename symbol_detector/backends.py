@@ -0,0 +1,132 @@
+import os
+from asyncio import get_running_loop
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from multiprocessing import get_context
+from time import perf_counter
+from typing import Optional
+
+from symbol_detector.core import draw_standard
+from symbol_detector.matcher import TemplateMatcher
+from symbol_detector.normalization import DEFAULT_NORMALIZATION
+from symbol_detector.trajectory import TrajectoryMatcher
+
+INLINE = "inline"
+THREAD = "thread"
+PROCESS = "process"
+EXECUTORS = (INLINE, THREAD, PROCESS)
+
+IMAGE = "image"
+TRAJECTORY = "trajectory"
+RECOGNIZERS = (IMAGE, TRAJECTORY)
+
+_worker_matcher: Optional[TemplateMatcher] = None
+_worker_image_size: Optional[int] = None
+
+
+def recognize(points, matcher: TemplateMatcher, image_size):
+    """Rasterizes, normalizes and matches a block of points, returns
+    (template index, relative error, normalized image, stage timings)"""
+    t0 = perf_counter()
+    gray_image = draw_standard(points, image_size)
+    t1 = perf_counter()
+    gray_image = matcher.normalizer(gray_image)
+    t2 = perf_counter()
+    index, diff = matcher.best_cos(gray_image)
+    t3 = perf_counter()
+    timings = {"rasterize": t1 - t0, "normalize": t2 - t1, "match": t3 - t2}
+    return index, diff, gray_image, timings
+
+
+def recognize_trajectory(points, matcher: TrajectoryMatcher):
+    """Matches the path of a block of points, returns
+    (template index, relative error, None, stage timings)"""
+    t0 = perf_counter()
+    index, diff = matcher.best(points)
+    return index, diff, None, {"match_trajectory": perf_counter() - t0}
+
+
+def _init_worker(
+    symbols, image_size, coarse_size, candidates, index_dims, index_path, normalization
+):
+    global _worker_matcher, _worker_image_size
+    _worker_matcher = TemplateMatcher(
+        symbols, coarse_size, candidates, index_dims, index_path, normalization
+    )
+    _worker_image_size = image_size
+
+
+def _recognize_in_worker(points):
+    return recognize(points, _worker_matcher, _worker_image_size)
+
+
+class RecognitionBackend:
+    """Runs the recognition inline, on a thread pool or on a process pool
+
+    The trajectory recognizer always runs inline, it takes less time than
+    handing the points over to a pool, and builds no image matcher. `matcher`
+    is the TemplateMatcher or the TrajectoryMatcher, both have the labels
+    and the images of the templates.
+    """
+
+    def __init__(
+        self,
+        executor: str,
+        symbols,
+        image_size,
+        workers: int = 0,
+        coarse_size: int = 0,
+        candidates: int = 32,
+        recognizer: str = IMAGE,
+        index_dims: int = 0,
+        index_path=None,
+        normalization: str = DEFAULT_NORMALIZATION,
+    ):
+        if executor not in EXECUTORS:
+            raise ValueError(f"Unknown executor '{executor}', use one of {EXECUTORS}")
+        if recognizer not in RECOGNIZERS:
+            raise ValueError(f"Unknown recognizer '{recognizer}', use one of {RECOGNIZERS}")
+        self.executor = executor
+        self.recognizer = recognizer
+        self.image_size = image_size
+        self._workers = workers or os.cpu_count() or 1
+        self._pool: Optional[Executor] = None
+        if recognizer == TRAJECTORY:
+            self.matcher = TrajectoryMatcher(symbols)
+            return
+        self.matcher = TemplateMatcher(
+            symbols, coarse_size, candidates, index_dims, index_path, normalization
+        )
+        if executor == THREAD:
+            self._pool = ThreadPoolExecutor(self._workers, "recognition")
+        elif executor == PROCESS:
+            self._pool = ProcessPoolExecutor(
+                self._workers,
+                mp_context=get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(
+                    symbols,
+                    image_size,
+                    coarse_size,
+                    candidates,
+                    index_dims,
+                    index_path,
+                    normalization,
+                ),
+            )
+
+    async def recognize(self, points):
+        if self.recognizer == TRAJECTORY:
+            return recognize_trajectory(points, self.matcher)
+        if self._pool is None:
+            return recognize(points, self.matcher, self.image_size)
+        loop = get_running_loop()
+        if self.executor == PROCESS:
+            return await loop.run_in_executor(self._pool, _recognize_in_worker, points)
+        return await loop.run_in_executor(
+            self._pool, recognize, points, self.matcher, self.image_size
+        )
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
@@ -0,0 +1,236 @@
+"""Recognizes every drawing and point trace of a directory against a symbol set
+
+    symbol-detector-batch captures/ --output results.csv
+    symbol-detector-batch captures/ --symbols ABC --output results.jsonl --top 3
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from glob import escape as glob_escape
+from json import dumps, loads
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+import cv2.cv2 as cv2
+import numpy as np
+
+from symbol_detector.backends import recognize
+from symbol_detector.constants import IMAGE_SIZE, SYMBOLS_DIR
+from symbol_detector.matcher import TemplateMatcher
+from symbol_detector.normalization import DEFAULT_NORMALIZATION, NORMALIZATIONS, normalization_for
+from symbol_detector.settings import DetectingOptionsModel, config
+from symbol_detector.symbols import preprocess_symbol, read_symbols
+from symbol_detector.traces import TRACE_SUFFIX, TraceReader
+from symbol_detector.trajectory import TRAJECTORY_SUFFIX
+
+IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".bmp")
+TRACE_SUFFIXES = (".npy", ".json")
+RECORDING_SUFFIXES = (TRACE_SUFFIX,)
+FIELDS = ["file", "label", "diff", "recognized", "runner_up", "runner_up_diff", "error"]
+# Defaults without a settings.json of the options the settings require,
+# the others default like in the settings
+_DEFAULTS = {
+    "symbol_set": "ABC",
+    "max_rel_error": 20.0,
+}
+
+_worker_matcher: Optional[TemplateMatcher] = None
+_worker_threshold = 0.0
+_worker_top = 1
+
+
+def list_inputs(directory) -> List[Path]:
+    suffixes = IMAGE_SUFFIXES + TRACE_SUFFIXES + RECORDING_SUFFIXES
+    return sorted(
+        path for path in Path(directory).rglob("*")
+        if path.is_file() and path.suffix.lower() in suffixes and not is_saved_trajectory(path)
+    )
+
+
+def is_saved_trajectory(path: Path) -> bool:
+    """A trajectory saved next to a symbol image, not a point trace"""
+    if path.suffix.lower() != TRAJECTORY_SUFFIX:
+        return False
+    return any(
+        sibling.suffix.lower() in IMAGE_SUFFIXES
+        for sibling in path.parent.glob(glob_escape(path.stem) + ".*")
+    )
+
+
+def read_trace(path: Path):
+    """Points of a trace: an N x 2 .npy array or a JSON list of [x, y]"""
+    if path.suffix.lower() == ".npy":
+        points = np.load(path)
+    else:
+        points = np.array(loads(path.read_text()))
+    return np.asarray(points, np.int32).reshape(-1, 2)
+
+
+def _init_worker(symbol_dir, threshold, top, coarse_size, candidates, normalization):
+    global _worker_matcher, _worker_threshold, _worker_top
+    # The pool already uses every core
+    cv2.setNumThreads(1)
+    _worker_matcher = TemplateMatcher(
+        read_symbols(symbol_dir, IMAGE_SIZE, normalization),
+        coarse_size,
+        candidates,
+        normalization=normalization,
+    )
+    _worker_threshold = threshold
+    _worker_top = top
+
+
+def recognize_file(path: Path) -> List[dict]:
+    """Results of a drawing or a trace, or of every block of a recording"""
+    matcher = _worker_matcher
+    suffix = path.suffix.lower()
+    try:
+        if suffix in RECORDING_SUFFIXES:
+            blocks = TraceReader(path).blocks()
+            return [_recognize_points(points, f"{path}#{i}") for i, points in enumerate(blocks)]
+        if suffix in TRACE_SUFFIXES:
+            return [_recognize_points(read_trace(path), str(path))]
+        gray_image = preprocess_symbol(str(path), IMAGE_SIZE, matcher.normalizer.name)
+        index, diff = matcher.best_cos(gray_image)
+        return [_result(str(path), index, diff, gray_image)]
+    except Exception as error:
+        return [{"file": str(path), "error": f"{type(error).__name__}: {error}"}]
+
+
+def _recognize_points(points, name) -> dict:
+    if len(points) < 3:
+        raise ValueError(f"{len(points)} points, a trace needs at least 3")
+    index, diff, gray_image, _ = recognize(points, _worker_matcher, IMAGE_SIZE)
+    return _result(name, index, diff, gray_image)
+
+
+def _result(name, index, diff, gray_image) -> dict:
+    matcher = _worker_matcher
+    result = {
+        "file": name,
+        "label": matcher.labels[index],
+        "diff": round(diff, 4),
+        "recognized": diff < _worker_threshold,
+    }
+    if _worker_top > 1:
+        diffs = matcher.cos_diffs(gray_image)
+        top = [(matcher.labels[i], float(diffs[i])) for i in matcher.top_k(diffs, len(diffs))]
+        # The best template of the next symbol
+        runner_up = next((t for t in top if t[0] != result["label"]), None)
+        if runner_up:
+            result.update(runner_up=runner_up[0], runner_up_diff=round(runner_up[1], 4))
+        result["top"] = [{"label": label, "diff": round(d, 4)} for label, d in top[:_worker_top]]
+    return result
+
+
+class ResultWriter:
+    """Writes results to a CSV or a JSON lines file as they arrive"""
+
+    def __init__(self, stream, fmt: str):
+        self._stream = stream
+        self._fmt = fmt
+        self._csv = csv.DictWriter(stream, FIELDS, extrasaction="ignore") if fmt == "csv" else None
+        if self._csv:
+            self._csv.writeheader()
+
+    def write(self, result: dict):
+        if self._csv:
+            self._csv.writerow(result)
+        else:
+            self._stream.write(dumps(result) + "\n")
+
+
+def run_batch(
+    paths: List[Path],
+    symbol_dir,
+    writer: ResultWriter,
+    threshold: float,
+    top=1,
+    workers=0,
+    chunksize=0,
+    coarse_size=0,
+    candidates=32,
+    normalization=DEFAULT_NORMALIZATION,
+) -> Iterable[dict]:
+    """Recognizes the files on a process pool, yields the results in order"""
+    workers = workers or os.cpu_count() or 1
+    chunksize = chunksize or max(1, min(64, len(paths) // (workers * 4)))
+    initargs = (symbol_dir, threshold, top, coarse_size, candidates, normalization)
+    # The template cache is written once, before the workers read it
+    read_symbols(symbol_dir, IMAGE_SIZE, normalization)
+    with get_context("spawn").Pool(workers, _init_worker, initargs) as pool:
+        for results in pool.imap(recognize_file, paths, chunksize):
+            for result in results:
+                writer.write(result)
+                yield result
+
+
+def _setting(name):
+    try:
+        return getattr(config, name)
+    except AttributeError:
+        if name in _DEFAULTS:
+            return _DEFAULTS[name]
+        return DetectingOptionsModel.__fields__[name].default
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("inputs", type=Path, help="directory of drawings and point traces")
+    parser.add_argument("--symbols", help="symbol set name or directory, default: the configured one")
+    parser.add_argument("--output", type=Path, help=".csv or .jsonl file, default: JSON lines to stdout")
+    parser.add_argument("--threshold", type=float, help="max. relative error of a recognition")
+    parser.add_argument("--top", type=int, default=1, help="list the k best templates too")
+    parser.add_argument("--workers", type=int, default=0, help="processes, default: all cores")
+    parser.add_argument("--chunksize", type=int, default=0, help="files handed to a worker at once")
+    parser.add_argument(
+        "--normalization", choices=NORMALIZATIONS, help="default: the one of the symbol set"
+    )
+    args = parser.parse_args()
+
+    try:
+        config.load()
+    except OSError:
+        pass
+    symbols = args.symbols or _setting("symbol_set")
+    symbol_dir = Path(symbols).resolve() if os.path.isdir(symbols) else SYMBOLS_DIR / symbols
+    threshold = args.threshold if args.threshold is not None else _setting("max_rel_error")
+    normalization = args.normalization or normalization_for(symbol_dir, _setting("normalization"))
+
+    paths = list_inputs(args.inputs)
+    fmt = "csv" if args.output and args.output.suffix.lower() == ".csv" else "jsonl"
+    stream = args.output.open("w", newline="") if args.output else sys.stdout
+    started = time.perf_counter()
+    results = recognized = failed = 0
+    try:
+        writer = ResultWriter(stream, fmt)
+        for result in run_batch(
+            paths,
+            symbol_dir,
+            writer,
+            threshold,
+            args.top,
+            args.workers,
+            args.chunksize,
+            _setting("cascade_size"),
+            _setting("cascade_candidates"),
+            normalization,
+        ):
+            results += 1
+            recognized += bool(result.get("recognized"))
+            failed += "error" in result
+    finally:
+        if args.output:
+            stream.close()
+    elapsed = time.perf_counter() - started
+    sys.stderr.write(
+        f"{len(paths)} files, {results} results, {recognized} recognized, {failed} failed"
+        f" in {elapsed:.2f} s ({len(paths) / elapsed if elapsed else 0:.1f} files/s)\n"
+    )
+
+
+if __name__ == "__main__":
+    run()
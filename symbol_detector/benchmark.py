@@ -0,0 +1,374 @@
+"""Micro-benchmarks of the image processing hot paths
+
+    symbol-detector-bench --output bench.json
+    symbol-detector-bench --baseline bench.json --filter compare
+    symbol-detector-bench --validate
+    symbol-detector-bench --accuracy
+"""
+import argparse
+import asyncio
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from dataclasses import dataclass, field
+from json import dumps, loads
+from pathlib import Path
+from typing import Callable, List
+
+import cv2.cv2 as cv2
+import numpy as np
+
+from symbol_detector import core
+from symbol_detector.constants import IMAGE_SIZE, BLUR_SIZE, BLUR_CYCLES, SYMBOLS_DIR
+from symbol_detector.core import FilterProperty
+from symbol_detector.matcher import TemplateMatcher
+from symbol_detector.normalization import NORMALIZATIONS, get_normalizer
+from symbol_detector.symbols import list_symbol_files, symbol_name
+from symbol_detector.trajectory import TrajectoryMatcher, make_trajectory
+
+RESOLUTIONS = [(640, 480), (800, 600), (1280, 720), (1920, 1080)]
+STROKE_SIZES = [50, 150, 400]
+LIBRARY_SIZES = [5, 50, 500, 5000]
+CASCADE_SIZE = 30
+CASCADE_CANDIDATES = 32
+INDEX_DIMS = 64
+FILTER_PROPERTY = FilterProperty(
+    y_min=32, y_max=47, cb_min=105, cb_max=112, cr_min=180, cr_max=204, blur=9
+)
+_SEED = 2017
+
+
+@dataclass
+class Case:
+    name: str
+    params: dict
+    setup: Callable[[], Callable[[], object]] = field(repr=False)
+
+
+def run_sync(result):
+    """Runs a coroutine which never suspends without an event loop"""
+    if not asyncio.iscoroutine(result):
+        return result
+    try:
+        result.send(None)
+    except StopIteration as stop:
+        return stop.value
+    result.close()
+    raise RuntimeError("The benchmarked coroutine suspended")
+
+
+def make_frame(width, height, rng: np.random.Generator):
+    """Noisy dark frame with one pointer-colored blob"""
+    frame = rng.integers(0, 40, [height, width, 3], dtype=np.uint8)
+    y_cr_cb = np.array([[[40, 192, 108]]], np.uint8)
+    color = cv2.cvtColor(y_cr_cb, cv2.COLOR_YCrCb2BGR)[0, 0]
+    cv2.circle(frame, (width // 3, height // 2), 12, tuple(int(c) for c in color), -1)
+    return frame
+
+
+def make_stroke(size, rng: np.random.Generator, n=8):
+    return (rng.random([n, 2]) * size).astype(np.int32) + 10
+
+
+def make_drawing(shape, size, rng: np.random.Generator):
+    im = np.zeros(shape, np.uint8)
+    cv2.polylines(im, [make_stroke(size, rng)], False, 255, 1)
+    return im
+
+
+def make_template(rng: np.random.Generator, size=IMAGE_SIZE):
+    im = make_drawing([400, 400], 300, rng)
+    im = core.resize_to_standard(im, size)
+    return core.ceil_blur(im, BLUR_SIZE, BLUR_CYCLES)
+
+
+def make_library(n, rng: np.random.Generator, unique=50):
+    """Symbol dict with n templates, shifted copies of a few unique ones"""
+    base = [make_template(rng) for _ in range(min(n, unique))]
+    symbols = {}
+    for i in range(n):
+        im = base[i % len(base)]
+        if i >= len(base):
+            im = np.roll(im, tuple(rng.integers(-3, 4, 2)), axis=(0, 1))
+        trajectory = make_trajectory(make_stroke(300, rng))
+        symbols.setdefault(f"S{i % 26}", list()).append((im, f"S{i % 26}-{i}.png", trajectory))
+    return symbols
+
+
+def build_cases() -> List[Case]:
+    cases = list()
+
+    for width, height in RESOLUTIONS:
+        params = {"resolution": f"{width}x{height}"}
+
+        def setup_filter(width=width, height=height):
+            frame = make_frame(width, height, np.random.default_rng(_SEED))
+            return lambda: run_sync(core.filter_image(frame, FILTER_PROPERTY))
+
+        def setup_segmenter(width=width, height=height):
+            frame = make_frame(width, height, np.random.default_rng(_SEED))
+            segmenter = core.Segmenter(FILTER_PROPERTY)
+            return lambda: segmenter.apply(frame)
+
+        cases.append(Case("filter_image", params, setup_filter))
+        cases.append(Case("Segmenter.apply", params, setup_segmenter))
+
+        for stroke_size in STROKE_SIZES:
+            params = {"resolution": f"{width}x{height}", "stroke": stroke_size}
+
+            def setup_contour(width=width, height=height, stroke_size=stroke_size):
+                im = make_drawing([height, width], stroke_size, np.random.default_rng(_SEED))
+                return lambda: core.my_contour(im)
+
+            def setup_resize(width=width, height=height, stroke_size=stroke_size):
+                im = make_drawing([height, width], stroke_size, np.random.default_rng(_SEED))
+                return lambda: core.resize_to_standard(im, IMAGE_SIZE)
+
+            cases.append(Case("my_contour", params, setup_contour))
+            cases.append(Case("resize_to_standard", params, setup_resize))
+
+    def setup_blur():
+        im = make_drawing([IMAGE_SIZE, IMAGE_SIZE], IMAGE_SIZE - 20, np.random.default_rng(_SEED))
+        return lambda: core.ceil_blur(im, BLUR_SIZE, BLUR_CYCLES)
+
+    cases.append(Case("ceil_blur", {"size": IMAGE_SIZE}, setup_blur))
+
+    for stage in NORMALIZATIONS:
+
+        def setup_normalize(stage=stage):
+            im = make_drawing([IMAGE_SIZE, IMAGE_SIZE], IMAGE_SIZE - 20, np.random.default_rng(_SEED))
+            normalizer = get_normalizer(stage)
+            return lambda: normalizer(im)
+
+        cases.append(Case("normalize", {"stage": stage}, setup_normalize))
+
+    for stroke_size in STROKE_SIZES:
+
+        def setup_draw(stroke_size=stroke_size):
+            points = make_stroke(stroke_size, np.random.default_rng(_SEED))
+            return lambda: core.draw_standard(points, IMAGE_SIZE)
+
+        cases.append(Case("draw_standard", {"stroke": stroke_size}, setup_draw))
+
+    for n in LIBRARY_SIZES:
+        params = {"templates": n}
+
+        def setup_cos(n=n):
+            rng = np.random.default_rng(_SEED)
+            matcher = TemplateMatcher(make_library(n, rng))
+            im = make_template(rng)
+            return lambda: run_sync(core.compare_cos(im, matcher))
+
+        def setup_abs(n=n):
+            rng = np.random.default_rng(_SEED)
+            matcher = TemplateMatcher(make_library(n, rng))
+            im = make_template(rng)
+            max_diff = (float(IMAGE_SIZE) ** 2.0) * 255.0
+            return lambda: run_sync(core.compare_absolute_diff(im, matcher, max_diff))
+
+        def setup_cascade(n=n):
+            rng = np.random.default_rng(_SEED)
+            matcher = TemplateMatcher(make_library(n, rng), CASCADE_SIZE, CASCADE_CANDIDATES)
+            im = make_template(rng)
+            return lambda: matcher.best_cos(im)
+
+        cases.append(Case("compare_cos", params, setup_cos))
+        cases.append(Case("compare_absolute_diff", params, setup_abs))
+
+        def setup_trajectory(n=n):
+            rng = np.random.default_rng(_SEED)
+            matcher = TrajectoryMatcher(make_library(n, rng))
+            points = make_stroke(300, rng)
+            return lambda: matcher.best(points)
+
+        def setup_index(n=n):
+            rng = np.random.default_rng(_SEED)
+            matcher = TemplateMatcher(make_library(n, rng), 0, CASCADE_CANDIDATES, INDEX_DIMS)
+            im = make_template(rng)
+            return lambda: matcher.best_cos(im)
+
+        cases.append(Case("best_cos_cascade", params, setup_cascade))
+        cases.append(Case("best_cos_index", params, setup_index))
+        cases.append(Case("trajectory_best", params, setup_trajectory))
+
+    return cases
+
+
+def measure(fn, repeat, min_time):
+    fn()
+    times = list()
+    started = time.perf_counter()
+    while len(times) < repeat or time.perf_counter() - started < min_time:
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times_ms = [1000.0 * t for t in times]
+    return {
+        "runs": len(times_ms),
+        "min_ms": min(times_ms),
+        "median_ms": statistics.median(times_ms),
+        "mean_ms": statistics.mean(times_ms),
+        "alloc_peak_bytes": peak,
+    }
+
+
+def case_id(name, params):
+    return name + "[" + ",".join(f"{k}={v}" for k, v in params.items()) + "]"
+
+
+def run_benchmarks(cases: List[Case], repeat=20, min_time=0.2, stream=sys.stdout):
+    results = list()
+    for case in cases:
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            stats = measure(case.setup(), repeat, min_time)
+        results.append({"name": case.name, "params": case.params, **stats})
+        stream.write(
+            f"{case_id(case.name, case.params):55s} {stats['median_ms']:10.3f} ms"
+            f" {stats['alloc_peak_bytes'] / 1024:10.1f} KiB\n"
+        )
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "machine": platform.machine(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare_to_baseline(report, baseline, stream=sys.stdout):
+    """Prints the median time ratio of every case found in both reports"""
+    old = {case_id(r["name"], r["params"]): r for r in baseline["results"]}
+    stream.write(f"\n{'case':55s} {'baseline':>10s} {'current':>10s} {'ratio':>7s}\n")
+    for result in report["results"]:
+        key = case_id(result["name"], result["params"])
+        if key not in old:
+            continue
+        before = old[key]["median_ms"]
+        after = result["median_ms"]
+        ratio = after / before if before else float("inf")
+        stream.write(f"{key:55s} {before:10.3f} {after:10.3f} {ratio:7.2f}\n")
+
+
+def make_queries(symbols, n, rng: np.random.Generator):
+    """Shifted, noisy copies of library templates and unrelated drawings"""
+    templates = [t[0] for values in symbols.values() for t in values]
+    queries = list()
+    for i in range(n):
+        if i % 4 == 3:
+            queries.append(make_template(rng))
+            continue
+        im = templates[rng.integers(len(templates))].astype(np.int16)
+        im = np.roll(im, tuple(rng.integers(-4, 5, 2)), axis=(0, 1))
+        im = im + rng.integers(-30, 31, im.shape)
+        queries.append(np.uint8(np.clip(im, 0, 255)))
+    return queries
+
+
+def validate_matchers(queries=200, stream=sys.stdout):
+    """Compares the decisions of the cascade and of the index with the
+    exhaustive search, returns True if they agree on every query"""
+    agree_all = True
+    for n in LIBRARY_SIZES:
+        rng = np.random.default_rng(_SEED)
+        symbols = make_library(n, rng)
+        matchers = {
+            "cascade": TemplateMatcher(symbols, CASCADE_SIZE, CASCADE_CANDIDATES),
+            "index": TemplateMatcher(symbols, 0, CASCADE_CANDIDATES, INDEX_DIMS),
+        }
+        agreed = dict.fromkeys(matchers, 0)
+        for im in make_queries(symbols, queries, rng):
+            exhaustive = int(matchers["cascade"].cos_diffs(im).argmin())
+            for name, matcher in matchers.items():
+                agreed[name] += matcher.best_cos(im)[0] == exhaustive
+        for name, count in agreed.items():
+            agree_all = agree_all and count == queries
+            stream.write(f"{name}[templates={n}] agrees on {count}/{queries} queries\n")
+    return agree_all
+
+
+def normalization_accuracy(symbol_dir=SYMBOLS_DIR / "ABC", stream=sys.stdout):
+    """Leave-one-out accuracy of every normalization stage on a symbol set:
+    each template is recognized among the others, with the stage's median
+    time per image"""
+    files = list_symbol_files(symbol_dir)
+    drawings = [
+        core.resize_to_standard(cv2.imread(str(Path(symbol_dir) / file), cv2.IMREAD_GRAYSCALE), IMAGE_SIZE)
+        for file in files
+    ]
+    labels = np.array([symbol_name(file) for file in files])
+    report = {}
+    for stage in NORMALIZATIONS:
+        normalizer = get_normalizer(stage)
+        times = list()
+        images = list()
+        for im in drawings:
+            t0 = time.perf_counter()
+            images.append(normalizer(im))
+            times.append(time.perf_counter() - t0)
+        matcher = TemplateMatcher({"": [(im, "", None) for im in images]})
+        correct = 0
+        for i, im in enumerate(images):
+            diffs = matcher.cos_diffs(im)
+            diffs[i] = np.inf
+            correct += labels[int(diffs.argmin())] == labels[i]
+        report[stage] = {
+            "accuracy": correct / len(files) if files else 0.0,
+            "median_ms": 1000.0 * statistics.median(times) if times else 0.0,
+        }
+        stream.write(
+            f"{stage:10s} accuracy {report[stage]['accuracy']:6.1%}"
+            f" {report[stage]['median_ms']:8.3f} ms / image ({len(files)} templates)\n"
+        )
+    return report
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", type=Path, help="write the results as JSON")
+    parser.add_argument("--baseline", type=Path, help="JSON results to compare with")
+    parser.add_argument("--filter", default="", help="run only cases containing this text")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per case")
+    parser.add_argument(
+        "--validate", action="store_true", help="check the cascade and the index against the exhaustive search"
+    )
+    parser.add_argument(
+        "--accuracy", action="store_true", help="compare the normalization stages on a symbol set"
+    )
+    parser.add_argument("--symbols", type=Path, default=SYMBOLS_DIR / "ABC", help="symbol set of --accuracy")
+    args = parser.parse_args()
+
+    if args.validate:
+        sys.exit(0 if validate_matchers() else 1)
+    if args.accuracy:
+        report = normalization_accuracy(args.symbols)
+        if args.output:
+            args.output.write_text(dumps(report, indent=2))
+        return
+
+    cases = [
+        case for case in build_cases()
+        if args.filter in case_id(case.name, case.params)
+    ]
+    report = run_benchmarks(cases, args.repeat, args.min_time)
+    if args.output:
+        args.output.write_text(dumps(report, indent=2))
+    if args.baseline:
+        compare_to_baseline(report, loads(args.baseline.read_text()))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,90 @@
+from threading import Thread, Condition
+from typing import Optional
+
+import numpy as np
+
+from symbol_detector.metrics import Metrics
+from symbol_detector.sources import FrameSource
+
+
+class FrameGrabber(Thread):
+    """Reads the frames of a source on its own thread into a ring buffer
+
+    The reader always gets the newest frame. The slot it got is not written
+    until the next call of `latest`, the writer cycles through the others.
+    """
+
+    def __init__(self, source: FrameSource, size=3, metrics: Metrics = None):
+        super().__init__(daemon=True)
+        self._metrics = metrics if metrics is not None else Metrics()
+        if size < 3:
+            raise ValueError("The ring buffer needs at least 3 slots")
+        self._source = source
+        self._size = size
+        self._slots: Optional[np.ndarray] = None
+        self._cond = Condition()
+        self._running = False
+        self._ended = False
+        self._seq = 0
+        self._latest = -1
+        self._held = -1
+        self.captured = 0
+        self.dropped = 0
+
+    def start(self):
+        self._running = True
+        super().start()
+
+    def stop(self):
+        self._running = False
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        try:
+            while self._running:
+                if self._slots is None:
+                    with self._metrics.timer("camera_read"):
+                        ret, frame = self._source.read()
+                    if not ret:
+                        break
+                    self._slots = np.empty((self._size,) + frame.shape, frame.dtype)
+                    slot = 0
+                    self._slots[slot] = frame
+                else:
+                    with self._cond:
+                        slot = self._free_slot()
+                    with self._metrics.timer("camera_read"):
+                        ret, _ = self._source.read_into(self._slots[slot])
+                    if not ret:
+                        break
+                with self._cond:
+                    self._latest = slot
+                    self._seq += 1
+                    self.captured += 1
+                    self._cond.notify_all()
+        finally:
+            with self._cond:
+                self._ended = True
+                self._cond.notify_all()
+
+    def _free_slot(self):
+        for i in range(self._size):
+            if i != self._latest and i != self._held:
+                return i
+
+    def latest(self, last_seq, timeout=0.0):
+        """Returns (seq, frame) of the newest frame after last_seq,
+        frame is None if there is no newer one within the timeout"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > last_seq or self._ended, timeout)
+            if self._seq <= last_seq:
+                return last_seq, None
+            if last_seq > 0:
+                self.dropped += self._seq - last_seq - 1
+            self._held = self._latest
+            return self._seq, self._slots[self._held]
+
+    @property
+    def ended(self):
+        return self._ended
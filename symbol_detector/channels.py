@@ -0,0 +1,46 @@
+from threading import Lock
+from time import monotonic
+
+
+class LatestValue:
+    """Keeps only the newest value, with the empty/get/put subset of Queue"""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._value = None
+        self._full = False
+
+    def put(self, value):
+        with self._lock:
+            self._value = value
+            self._full = True
+
+    def get(self):
+        with self._lock:
+            value = self._value
+            self._value = None
+            self._full = False
+            return value
+
+    def empty(self):
+        return not self._full
+
+
+class PreviewChannel(LatestValue):
+    """Latest preview frame, rendered only when the consumer has taken the
+    previous one and the rate limit allows it"""
+
+    def __init__(self, width: int, height: int, fps: float):
+        super().__init__()
+        self.size = (width, height)
+        self._interval = 1.0 / fps if fps > 0 else 0.0
+        self._next_time = 0.0
+
+    def wants_frame(self) -> bool:
+        if self._full:
+            return False
+        now = monotonic()
+        if now < self._next_time:
+            return False
+        self._next_time = now + self._interval
+        return True
@@ -6,3 +6,8 @@ DEFAULT_CONFIG_PATH = BASE_DIR.parent / "settings.json"
 IMAGE_SIZE = 150
 PAD_X = 5
 PAD_Y = 5
+BLUR_SIZE = 15
+BLUR_CYCLES = 3
+CACHE_DIR = BASE_DIR / ".cache"
+# Latency percentiles reported by the metrics and the evaluation
+PERCENTILES = (50, 95, 99)
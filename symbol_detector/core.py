@@ -1,9 +1,14 @@
 from dataclasses import dataclass
+from typing import Union
 
 import cv2.cv2 as cv2
 import numpy as np
 
-from symbol_detector.settings import Config
+from symbol_detector.matcher import TemplateMatcher
+from symbol_detector.normalization import BoxNormalizer
+from symbol_detector.settings import Config, ConfigSnapshot
+
+_SHIFT = 4
 
 
 @dataclass
@@ -16,64 +21,37 @@ class FilterProperty:
     cr_max: int
     blur: int
 
-    def load_from_settings(self, config: Config):
+    def load_from_settings(self, config: Union[Config, ConfigSnapshot]):
         for key in self.__dict__.keys():
             setattr(self, key, getattr(config, key))
 
 
 async def compare_absolute_diff(gray_image, symbols, max_diff):
     """Absolute difference method"""
-    diff_dict = {}
-    for k in symbols.keys():
-        for t in symbols[k]:
-            im = t[0]
-            sum_diff = float(np.sum(cv2.absdiff(im, gray_image)))
-            rel_diff = 100.0 * sum_diff / max_diff
-            diff_dict[rel_diff] = (k, im, rel_diff)
-    diffs = list(diff_dict)
-    diffs.sort()
-    return diff_dict[diffs[0]]
+    return _get_matcher(symbols).compare_absolute_diff(gray_image, max_diff)
 
 
 async def compare_cos(gray_image, symbols):
     """Cosine method"""
-    diff_dict = {}
-    im0 = np.float32(gray_image)
-    for k in symbols.keys():
-        for t in symbols[k]:
-            im1 = np.float32(t[0])
-            rel_diff = 100.0 * (
-                    1.0
-                    - (
-                            np.sum(im0 * im1)
-                            / ((np.sum(im0 * im0) ** 0.5) * (np.sum(im1 * im1) ** 0.5))
-                    )
-            )
-            diff_dict[rel_diff] = (k, t[0], rel_diff)
-            # print((k, t[0], rel_diff))
-    diffs = list(diff_dict)
-    diffs.sort()
-    print(diffs[0])
-    return diff_dict[diffs[0]]
+    typ, ref, diff = _get_matcher(symbols).compare_cos(gray_image)
+    print(diff)
+    return typ, ref, diff
+
+
+def _get_matcher(symbols) -> TemplateMatcher:
+    if isinstance(symbols, TemplateMatcher):
+        return symbols
+    return TemplateMatcher(symbols)
 
 
 def my_contour(thresh):
     """ Returns those pixel's coordinates, which's value is not 0"""
-    points = np.nonzero(thresh)
-    positions = list()
-    contours = list()
-    for j in range(0, len(points[0])):
-        y = int(points[0][j])
-        x = int(points[1][j])
-        positions.append(np.array([x, y]))
-    positions_array = np.array(positions)
-    contours.append(positions_array)
-    return np.array(contours)
+    ys, xs = np.nonzero(np.asarray(thresh).reshape(thresh.shape[0], thresh.shape[1]))
+    return np.stack([xs, ys], axis=1).reshape(1, -1, 2)
 
 
 def resize_to_standard(thresh, size):
-    contour = my_contour(thresh)
-    x, y, w, h = cv2.boundingRect(contour)
+    x, y, w, h = cv2.boundingRect(thresh)
     if w > h:
         d = int((w - h) / 2.0)
         im = np.zeros([w, w], np.uint8)
@@ -85,35 +63,85 @@ def resize_to_standard(thresh, size):
     return cv2.resize(im, (size, size), interpolation=cv2.INTER_LINEAR)
 
 
+def draw_standard(points, size):
+    """Draws the path into a square image of the given size,
+    placed like resize_to_standard places a drawing"""
+    pts = np.asarray(points, np.float64).reshape(-1, 2)
+    top_left = pts.min(axis=0)
+    w, h = pts.max(axis=0) - top_left + 1
+    side = max(w, h)
+    offset = np.array([int((side - w) / 2.0), int((side - h) / 2.0)])
+    scale = size / side
+    mapped = np.clip((pts - top_left + offset + 0.5) * scale - 0.5, 0, size - 1)
+    im = np.zeros([size, size], np.uint8)
+    fixed = np.round(mapped * (1 << _SHIFT)).astype(np.int32)
+    thickness = max(1, int(round(scale)))
+    cv2.polylines(im, [fixed], False, 255, thickness, cv2.LINE_8, _SHIFT)
+    return im
+
+
+def draw_drawing(points):
+    """Draws the path into an image of the size of its bounding rectangle"""
+    pts = np.asarray(points, np.int32).reshape(-1, 2)
+    top_left = pts.min(axis=0)
+    w, h = pts.max(axis=0) - top_left + 1
+    im = np.zeros([h, w], np.uint8)
+    cv2.polylines(im, [pts - top_left], False, 255, 1)
+    return im
+
+
 def ceil_blur(gray_image, b, cycles):
     """Applies maximum blur"""
-    image = gray_image.copy()
-    lookup_table = np.zeros(256, np.uint8)
-    for i in range(cycles):
-        image = cv2.blur(image, (b, b))
-    maximum = 255.0 / np.amax(image)
-    for i in range(256):
-        lookup_table[i] = np.uint8(i * maximum)
-    image = lookup_table[image]
-    return image
+    return BoxNormalizer(b, cycles)(gray_image)
+
+
+class Segmenter:
+    """Finds the pointer's pixels, reusing the frame-sized buffers between frames.
+    The kernels are scaled for frames downscaled by `scale`."""
+
+    def __init__(self, fp: FilterProperty, scale=1.0):
+        self._shape = None
+        self._scale = scale
+        self.update(fp)
+
+    def update(self, fp: FilterProperty):
+        blur = max(1, int(round(fp.blur * self._scale)))
+        smooth = max(1, int(round(7 * self._scale)))
+        self._blur = (blur, blur)
+        self._smooth_size = (smooth, smooth)
+        self._lower = np.array([fp.y_min, fp.cr_min, fp.cb_min])
+        self._upper = np.array([fp.y_max, fp.cr_max, fp.cb_max])
+
+    def _allocate(self, shape):
+        self._shape = shape
+        self._blurred = np.empty(shape, np.uint8)
+        self._y_cr_cb = np.empty(shape, np.uint8)
+        self._mask = np.empty(shape[:2], np.uint8)
+        self._smooth = np.empty(shape[:2], np.uint8)
+        self._thresh = np.empty(shape[:2], np.uint8)
+
+    def apply(self, image):
+        """Returns the mirrored binary image, valid until the next call"""
+        if image.shape != self._shape:
+            self._allocate(image.shape)
+        cv2.blur(image, self._blur, dst=self._blurred)
+        cv2.cvtColor(self._blurred, cv2.COLOR_BGR2YCrCb, dst=self._y_cr_cb)
+        self.threshold(self._y_cr_cb)
+        return cv2.flip(self._mask, 1, dst=self._thresh)
+
+    def threshold(self, y_cr_cb):
+        """Returns the binary image of an already blurred YCrCb frame, not mirrored"""
+        if y_cr_cb.shape != self._shape:
+            self._allocate(y_cr_cb.shape)
+        cv2.inRange(y_cr_cb, self._lower, self._upper, dst=self._mask)
+        cv2.blur(self._mask, self._smooth_size, dst=self._smooth)
+        cv2.threshold(self._smooth, 10, 255, cv2.THRESH_BINARY, dst=self._mask)
+        return self._mask
 
 
 async def filter_image(image, fp: FilterProperty):
     """Helps finding the pointer"""
-    im = image.copy()
-    im = cv2.blur(im, (fp.blur, fp.blur))
-    im = cv2.cvtColor(im, cv2.COLOR_BGR2YCrCb)
-    im = cv2.inRange(
-        im,
-        np.array([fp.y_min, fp.cr_min, fp.cb_min]),
-        np.array([fp.y_max, fp.cr_max, fp.cb_max]),
-    )
-    mask = im > 0
-    im = np.zeros([image.shape[0], image.shape[1], 1], np.uint8)
-    im[:, :, 0] = 255 * mask
-    im = cv2.blur(im, (7, 7))
-    _, thresh = cv2.threshold(im, 10, 255, cv2.THRESH_BINARY)
-    return cv2.flip(thresh, 1)
+    return Segmenter(fp).apply(image)
 
 
 async def get_center(contour):
@@ -141,8 +169,7 @@ async def calc_dist_between_2_points(p0, p1):
 
 
 def copy_drawing(thresh):
-    cnt = my_contour(thresh)
-    x, y, w, h = cv2.boundingRect(cnt)
+    x, y, w, h = cv2.boundingRect(thresh)
     im = np.zeros([h, w], np.uint8)
     im[:, :] = thresh[y: y + h, x: x + w]
     return im
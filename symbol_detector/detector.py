@@ -1,18 +1,52 @@
+from asyncio import gather
 from queue import Queue
+from typing import List, Optional
 
+from symbol_detector.backends import TRAJECTORY
+from symbol_detector.channels import PreviewChannel
 from symbol_detector.constants import IMAGE_SIZE
+from symbol_detector.incremental import IncrementalRecognizer
+from symbol_detector.metrics import Metrics, MetricsDumper
+from symbol_detector.normalization import DEFAULT_NORMALIZATION
+from symbol_detector.settings import ConfigWatcher, config
+from symbol_detector.sources import FrameSource, camera_sources_from_config
+from symbol_detector.traces import trace_path_for
 from symbol_detector.workers import FrameProcessor, ShapeDetector
 
 
 class Detector:
-    def __init__(self, symbols, gui=True, callback=None):
-        FrameProcessor.init_camera()
+    """Detects symbols on one or more frame sources with a shared recognition backend
 
+    The callback is called as `callback(symbol)`, with `tag_sources` as
+    `callback(symbol, source_name)` to tell the sources apart.
+    The symbols have to be normalized with `normalization`, by default the
+    one configured for the symbol set.
+    """
+
+    def __init__(
+        self,
+        symbols,
+        gui=True,
+        callback=None,
+        source: FrameSource = None,
+        sources: List[FrameSource] = None,
+        normalization: str = None,
+        tag_sources: bool = False,
+    ):
+        if sources is None:
+            sources = [source] if source is not None else camera_sources_from_config()
+        _make_names_unique(sources)
+        self._sources = sources
         self._gui = gui
+        self.metrics = Metrics()
+        self._metrics_dumper: Optional[MetricsDumper] = None
+        self._config_watcher: Optional[ConfigWatcher] = None
 
         if self._gui:
             self.ref_queue = Queue()
-            self.thresh_queue = Queue()
+            self.thresh_queue = PreviewChannel(
+                config.preview_width, config.preview_height, config.preview_fps
+            )
             self.result_queue = Queue()
         else:
             self.ref_queue = None
@@ -22,22 +56,127 @@ class Detector:
         self._shape_detector = ShapeDetector(
             symbols,
             IMAGE_SIZE,
-            FrameProcessor.shape,
             self.ref_queue,
             self.result_queue,
             callback,
+            metrics=self.metrics,
+            normalization=normalization,
+            tag_sources=tag_sources,
         )
-        self._frame_handler = FrameProcessor(
-            self._shape_detector.process, self.thresh_queue
+        self._early_recognizers: List[IncrementalRecognizer] = list()
+        labeled = len(sources) > 1
+        self._frame_handlers = [
+            FrameProcessor(
+                self._shape_detector.process,
+                self.thresh_queue if i == 0 else None,
+                source,
+                self.metrics.labeled(source=source.name) if labeled else self.metrics,
+                self._trace_path(source.name if labeled else None),
+                self._early_recognizer(),
+            )
+            for i, source in enumerate(sources)
+        ]
+
+    def _early_recognizer(self) -> Optional[IncrementalRecognizer]:
+        # Early decisions score images, the trajectory recognizer has no image matcher
+        if not config.early_commit or self._shape_detector.recognizer == TRAJECTORY:
+            return None
+        early = IncrementalRecognizer(
+            self._shape_detector.matcher,
+            IMAGE_SIZE,
+            config.max_rel_error,
+            config.early_margin,
+            config.early_interval,
+            config.early_min_points,
+            config.early_still_px,
         )
+        self._early_recognizers.append(early)
+        return early
+
+    def set_symbols(self, symbols, index_path=None, normalization=DEFAULT_NORMALIZATION):
+        """Publishes a new version of the symbol library to the running recognition,
+        a SymbolLibrary subscriber"""
+        self._shape_detector.set_symbols(symbols, index_path, normalization)
+        if self._shape_detector.recognizer == TRAJECTORY:
+            return
+        for early in self._early_recognizers:
+            early.set_matcher(self._shape_detector.matcher)
+
+    @staticmethod
+    def _trace_path(source_name):
+        if not config.recording_trace_file:
+            return None
+        return trace_path_for(config.recording_trace_file, source_name)
+
+    def save_im(self, filename: str, source: str = None):
+        """Saves the last block of `source`, by default of the previewed first source"""
+        if source is None:
+            source = self._sources[0].name
+        self._shape_detector.save_actual(filename, source)
 
-        FrameProcessor.release_camera()
+    def get_metrics(self) -> dict:
+        """Stage latency percentiles (seconds), counters (with the tracking hits
+        and fallbacks) and queue depths"""
+        return self.metrics.snapshot()
 
-    def save_im(self, filename: str):
-        self._shape_detector.save_actual(filename)
+    def close(self):
+        self._stop_metrics_dumper()
+        self._stop_config_watcher()
+        self._shape_detector.close()
 
     def loop_start(self):
-        self._frame_handler.loop_start()
+        if config.metrics_file and self._metrics_dumper is None:
+            self._metrics_dumper = MetricsDumper(
+                self.metrics, config.metrics_file, config.metrics_interval
+            )
+            self._metrics_dumper.start()
+        if config.reload_interval > 0 and self._config_watcher is None:
+            self._config_watcher = ConfigWatcher(
+                config, config.reload_interval, lambda: self.metrics.increment("config_reloads")
+            )
+            self._config_watcher.start()
+        self._start_frame_handlers()
+
+    def _start_frame_handlers(self):
+        if len(self._frame_handlers) == 1:
+            self._frame_handlers[0].loop_start()
+            return
+        # Every source gets its own thread and loop, the frame work of one camera
+        # doesn't hold up the others
+        for handler in self._frame_handlers:
+            handler.thread_start()
 
     def loop_stop(self):
-        self._frame_handler.loop_stop()
+        for handler in self._frame_handlers:
+            handler.loop_stop()
+        self._stop_metrics_dumper()
+        self._stop_config_watcher()
+
+    def _stop_config_watcher(self):
+        if self._config_watcher is not None:
+            self._config_watcher.stop()
+            self._config_watcher = None
+
+    def _stop_metrics_dumper(self):
+        if self._metrics_dumper is not None:
+            self._metrics_dumper.stop()
+            self._metrics_dumper = None
+
+    async def run(self):
+        """Processes the frame source on the running event loop until it ends or is stopped"""
+        self.loop_start()
+        await gather(*(handler.join() for handler in self._frame_handlers))
+        self._stop_metrics_dumper()
+        self._stop_config_watcher()
+
+
+def _make_names_unique(sources: List[FrameSource]):
+    names = {source.name for source in sources}
+    used = set()
+    for source in sources:
+        if source.name in used:
+            count = 1
+            while f"{source.name}_{count}" in used or f"{source.name}_{count}" in names:
+                count += 1
+            source.name = f"{source.name}_{count}"
+        used.add(source.name)
@@ -0,0 +1,243 @@
+"""Replays a labeled corpus of point blocks through the recognition and reports the accuracy
+
+    symbol-detector-eval corpus/ --output eval.json
+    symbol-detector-eval corpus/ --matchers exhaustive,cascade --normalizations box,distance
+    symbol-detector-eval corpus/ --baseline eval.json
+
+A corpus is a directory of point traces (.npy or .json, see symbol-detector-batch)
+named <symbol>-<anything> or placed in a directory named after the symbol, and of
+.sdt recordings with a <stem>.labels file holding the symbol of each recorded
+block on its own line.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from contextlib import redirect_stdout
+from dataclasses import dataclass
+from json import dumps, loads
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from symbol_detector.backends import IMAGE, TRAJECTORY
+from symbol_detector.batch import (
+    RECORDING_SUFFIXES,
+    TRACE_SUFFIXES,
+    is_saved_trajectory,
+    read_trace,
+)
+from symbol_detector.constants import IMAGE_SIZE, PERCENTILES, SYMBOLS_DIR
+from symbol_detector.normalization import DEFAULT_NORMALIZATION, NORMALIZATIONS
+from symbol_detector.settings import DetectingOptionsModel, config
+from symbol_detector.symbols import INDEX_FILE, get_cache_dir, read_symbols, symbol_name
+from symbol_detector.traces import TraceReader
+from symbol_detector.workers import ShapeDetector
+
+LABELS_SUFFIX = ".labels"
+REJECTED = "rejected"
+# The recognizer of each matcher
+MATCHERS = {"exhaustive": IMAGE, "cascade": IMAGE, "index": IMAGE, "trajectory": TRAJECTORY}
+# Index dimensions when the settings don't enable the index
+DEFAULT_INDEX_DIMS = 64
+
+
+@dataclass
+class Block:
+    source: str
+    label: str
+    points: np.ndarray
+
+
+def load_corpus(directory) -> List[Block]:
+    blocks = list()
+    for path in sorted(Path(directory).rglob("*")):
+        suffix = path.suffix.lower()
+        if suffix in TRACE_SUFFIXES and path.is_file() and not is_saved_trajectory(path):
+            blocks.append(Block(str(path), _trace_label(path), read_trace(path)))
+        elif suffix in RECORDING_SUFFIXES:
+            labels_path = path.with_suffix(LABELS_SUFFIX)
+            if not labels_path.exists():
+                continue
+            labels = labels_path.read_text().split()
+            for i, (label, points) in enumerate(zip(labels, TraceReader(path).blocks())):
+                blocks.append(Block(f"{path}#{i}", label, points))
+    return blocks
+
+
+def _trace_label(path: Path):
+    return symbol_name(path.name) if "-" in path.name else path.parent.name
+
+
+def matcher_options(matcher: str) -> dict:
+    """ShapeDetector options of a matcher, with the configured cascade and index
+    sizes or their defaults when the settings turn them off"""
+    cascade_size = config.cascade_size or DetectingOptionsModel.__fields__["cascade_size"].default
+    index_dims = config.index_dims or DEFAULT_INDEX_DIMS
+    return {
+        "recognizer": MATCHERS[matcher],
+        "cascade_size": cascade_size if matcher == "cascade" else 0,
+        "index_dims": index_dims if matcher == "index" else 0,
+    }
+
+
+async def evaluate(
+    blocks: List[Block],
+    symbol_dir,
+    matcher: str,
+    normalization: Optional[str],
+    executor="inline",
+) -> dict:
+    """Recognizes every block with ShapeDetector.process, like the detector does"""
+    stage = normalization or DEFAULT_NORMALIZATION
+    symbols = read_symbols(symbol_dir, IMAGE_SIZE, stage, cache=False)
+    detector = ShapeDetector(
+        symbols,
+        IMAGE_SIZE,
+        executor=executor,
+        normalization=stage,
+        index_path=get_cache_dir(symbol_dir) / INDEX_FILE,
+        **matcher_options(matcher),
+    )
+    threshold = config.max_trajectory_error if matcher == "trajectory" else config.max_rel_error
+    predictions = list()
+    latencies = list()
+    try:
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            for block in blocks:
+                started = time.perf_counter()
+                result = await detector.process(block.points.tolist())
+                latencies.append(time.perf_counter() - started)
+                predictions.append(result)
+    finally:
+        detector.close()
+    return _report(blocks, matcher, normalization, threshold, predictions, latencies)
+
+
+def _report(blocks, matcher, normalization, threshold, predictions, latencies) -> dict:
+    n = len(blocks)
+    correct = accepted = accepted_correct = 0
+    confusion: Dict[str, Dict[str, int]] = {}
+    rejected: Dict[str, int] = {}
+    labels = list()
+    for block, result in zip(blocks, predictions):
+        label, _, recognized = result if result else (REJECTED, None, False)
+        labels.append(label)
+        row = confusion.setdefault(block.label, {})
+        row[label] = row.get(label, 0) + 1
+        correct += label == block.label
+        if recognized:
+            accepted += 1
+            accepted_correct += label == block.label
+        else:
+            rejected[block.label] = rejected.get(block.label, 0) + 1
+    latencies_ms = np.array(latencies) * 1000.0
+    return {
+        "name": f"{matcher}/{normalization}" if normalization else matcher,
+        "matcher": matcher,
+        "normalization": normalization,
+        "threshold": threshold,
+        "blocks": n,
+        "accuracy": correct / n if n else 0.0,
+        "reject_rate": (n - accepted) / n if n else 0.0,
+        "accepted_accuracy": accepted_correct / accepted if accepted else 0.0,
+        "latency_ms": {
+            **{f"p{p}": float(np.percentile(latencies_ms, p)) if n else 0.0 for p in PERCENTILES},
+            "mean": float(latencies_ms.mean()) if n else 0.0,
+        },
+        "confusion": confusion,
+        "rejected": rejected,
+        "predictions": labels,
+    }
+
+
+def configurations(matchers: List[str], normalizations: List[str]):
+    """(matcher, normalization) pairs, the trajectory matcher doesn't normalize"""
+    pairs = list()
+    for matcher in matchers:
+        if MATCHERS[matcher] == TRAJECTORY:
+            pairs.append((matcher, None))
+            continue
+        pairs.extend((matcher, normalization) for normalization in normalizations)
+    return pairs
+
+
+def compare_to_baseline(report, baseline, stream=sys.stdout) -> bool:
+    """Prints the accuracy change and the share of equal decisions of every
+    configuration found in both reports, returns False if any lost accuracy"""
+    old = {result["name"]: result for result in baseline["results"]}
+    kept = True
+    stream.write(f"\n{'configuration':24s} {'baseline':>9s} {'current':>9s} {'same':>7s}\n")
+    for result in report["results"]:
+        before = old.get(result["name"])
+        if before is None:
+            continue
+        same = sum(a == b for a, b in zip(before["predictions"], result["predictions"]))
+        agreement = same / len(result["predictions"]) if result["predictions"] else 1.0
+        kept = kept and result["accuracy"] >= before["accuracy"]
+        stream.write(
+            f"{result['name']:24s} {before['accuracy']:9.1%} {result['accuracy']:9.1%}"
+            f" {agreement:7.1%}\n"
+        )
+    return kept
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("corpus", type=Path, help="directory of labeled traces and recordings")
+    parser.add_argument("--symbols", help="symbol set name or directory, default: the configured one")
+    parser.add_argument("--matchers", default="exhaustive,cascade", help=f"of {', '.join(MATCHERS)}")
+    parser.add_argument(
+        "--normalizations", default=",".join(NORMALIZATIONS), help=f"of {', '.join(NORMALIZATIONS)}"
+    )
+    parser.add_argument("--executor", default="inline", help="inline, thread or process")
+    parser.add_argument("--output", type=Path, help="write the report as JSON")
+    parser.add_argument("--baseline", type=Path, help="report to compare with, exits with 1 on lost accuracy")
+    args = parser.parse_args()
+
+    try:
+        config.load()
+    except OSError as error:
+        sys.exit(f"The thresholds come from the settings, {error}")
+    matchers = args.matchers.split(",")
+    normalizations = args.normalizations.split(",")
+    for name in matchers:
+        if name not in MATCHERS:
+            sys.exit(f"Unknown matcher '{name}', use one of {tuple(MATCHERS)}")
+    for name in normalizations:
+        if name not in NORMALIZATIONS:
+            sys.exit(f"Unknown normalization '{name}', use one of {NORMALIZATIONS}")
+    symbols = args.symbols or config.symbol_set
+    symbol_dir = Path(symbols).resolve() if os.path.isdir(symbols) else SYMBOLS_DIR / symbols
+
+    blocks = load_corpus(args.corpus)
+    if not blocks:
+        sys.exit(f"No labeled blocks in {args.corpus}")
+    results = list()
+    for matcher, normalization in configurations(matchers, normalizations):
+        result = asyncio.run(evaluate(blocks, symbol_dir, matcher, normalization, args.executor))
+        results.append(result)
+        latency = result["latency_ms"]
+        sys.stdout.write(
+            f"{result['name']:24s} accuracy {result['accuracy']:6.1%}"
+            f"  rejected {result['reject_rate']:6.1%}"
+            f"  p50 {latency['p50']:7.3f} ms  p99 {latency['p99']:7.3f} ms\n"
+        )
+    report = {
+        "corpus": {
+            "path": str(args.corpus),
+            "symbols": str(symbol_dir),
+            "blocks": [{"source": block.source, "label": block.label} for block in blocks],
+        },
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(dumps(report, indent=2))
+    if args.baseline and not compare_to_baseline(report, loads(args.baseline.read_text())):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run()
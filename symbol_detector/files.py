@@ -0,0 +1,21 @@
+import os
+import tempfile
+from pathlib import Path
+from typing import Callable
+
+
+def replace_file(path: Path, write: Callable):
+    """Writes a file through a temporary file of a unique name next to it,
+    processes sharing a cache never write the same temporary file"""
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.stem + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            write(file)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
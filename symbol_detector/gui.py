@@ -1,16 +1,21 @@
 import os
 import tkinter
-from queue import Queue
+from queue import Queue, Empty
 from tkinter import ttk
-from asyncio import sleep
+from typing import Union
 import numpy as np
 from PIL import Image, ImageTk
 
 from symbol_detector import sampler, symbols
+from symbol_detector.channels import LatestValue
 from symbol_detector.detector import Detector
+from symbol_detector.normalization import normalization_for
 from symbol_detector.constants import PAD_X, PAD_Y, IMAGE_SIZE, SYMBOLS_DIR
 from symbol_detector.settings import config
-from symbol_detector.workers import BaseWorker
+from symbol_detector.trajectory import trajectory_path
+
+# Shortest preview poll interval, also used when the fps is not positive
+_MIN_INTERVAL_MS = 10
 
 
 class MainWindow(tkinter.Tk):
@@ -18,9 +23,13 @@ class MainWindow(tkinter.Tk):
         tkinter.Tk.__init__(self)
         self._px = PAD_X
         self._py = PAD_Y
-        self.sym_dir = "%s/%s/" % (SYMBOLS_DIR, config.symbol_set)
-        self.symbols = symbols.read_symbols(self.sym_dir, IMAGE_SIZE)
-        self.core = Detector(self.symbols)
+        self.library = symbols.SymbolLibrary(
+            "%s/%s/" % (SYMBOLS_DIR, config.symbol_set),
+            IMAGE_SIZE,
+            normalization_for(config.symbol_set, config.normalization),
+        )
+        self.core = Detector(self.library.symbols, normalization=self.library.normalization)
+        self.library.subscribe(self.core.set_symbols)
         self.wm_title("Symbol detector")
         self._window_help: WindowHelp = None
 
@@ -38,7 +47,9 @@ class MainWindow(tkinter.Tk):
         self.config(menu=self.menu_bar)
         # end menu
 
-        self.im_thresh = FrameImage(self, self.core.thresh_queue, 640, 480)
+        self.im_thresh = FrameImage(
+            self, self.core.thresh_queue, config.preview_width, config.preview_height
+        )
         self.im_thresh.grid(row=1, column=1, rowspan=2, padx=self._px, pady=self._py)
         self.im_drawing = FrameImage(
             self, self.core.result_queue, IMAGE_SIZE, IMAGE_SIZE
@@ -53,10 +64,11 @@ class MainWindow(tkinter.Tk):
     def destroy(self):
         self.stop_core()
         self.stop_refreshing()
+        self.core.close()
         super().destroy()
 
     def start_core(self):
-        if not self.symbols:
+        if not self.library.symbols:
             return
         self.core.loop_start()
         self.start_refreshing()
@@ -124,9 +136,9 @@ class WindowSymbolSaver(tkinter.Toplevel):
             hex_name += x[2:]
         s = bytes.fromhex(hex_name).decode("utf-8")
         if s != "":
-            n = symbols.get_next_nr(s, self.master.symbols)
+            n = symbols.get_next_nr(s, self.master.library.symbols)
             file_name = "%s-%s.png" % (s0, n)
-            file_name = "%s%s" % (self.master.sym_dir, file_name)
+            file_name = "%s%s" % (self.master.library.directory, file_name)
             u_file_name = file_name.encode("utf-8")
             hex_name = ""
             for c in file_name:
@@ -136,9 +148,13 @@ class WindowSymbolSaver(tkinter.Toplevel):
             self.master.core.save_im(ascii_name)
             try:
                 os.rename(ascii_name, u_file_name.decode("utf-8"))
+                os.rename(
+                    trajectory_path(ascii_name),
+                    trajectory_path(u_file_name.decode("utf-8")),
+                )
             except:
                 pass
-            self.master.symbols = symbols.read_symbols(self.master.sym_dir, IMAGE_SIZE)
+            self.master.library.add(os.path.basename(u_file_name.decode("utf-8")))
             self.destroy()
 
 
@@ -161,8 +177,11 @@ class WindowSymbolsSelector(tkinter.Toplevel):
     def select_settings(self, _):
         config.symbol_set = self.combo_syms.get()
         config.save()
-        self.master.sym_dir = "%s/%s/" % (SYMBOLS_DIR, self.combo_syms.get())
-        self.master.symbols = symbols.read_symbols(self.master.sym_dir, IMAGE_SIZE)
+        symbol_set = self.combo_syms.get()
+        self.master.library.switch(
+            "%s/%s/" % (SYMBOLS_DIR, symbol_set),
+            normalization_for(symbol_set, config.normalization),
+        )
         self.destroy()
 
 
@@ -180,7 +199,8 @@ class WindowHelp(tkinter.Toplevel):
             ["-", "Decrease lightness"],
             ["Left click", "Mark the center of the circle"],
             ["Right click", "Point on the radius"],
-            ["Middle click", "Calculate parameters"],
+            ["Middle click", "Calculate parameters from this frame"],
+            ["c", "Calculate parameters from a burst of frames,\nhold the pointer in the circle"],
             ["d", "Delete calculated parameters"],
             ["q", "Quit"],
         ]
@@ -190,34 +210,54 @@ class WindowHelp(tkinter.Toplevel):
         self.label_help.pack()
 
 
-class FrameImage(tkinter.Label, BaseWorker):
-    def __init__(self, master: MainWindow, in_queue: Queue, width, height):
-        BaseWorker.__init__(self)
-        self.im = np.zeros([height, width, 3], np.uint8)
-        self.im = symbols.cv2.cvtColor(self.im, symbols.cv2.COLOR_RGB2RGBA)
-        self.im = Image.fromarray(self.im)
+class FrameImage(tkinter.Label):
+    """Shows the newest frame of a queue, polled with Tk's after() on the main
+    thread at most `fps` times a second. The frames are pasted into the same
+    PhotoImage, the frames in between are dropped."""
+
+    def __init__(
+        self, master: MainWindow, in_queue: Union[Queue, LatestValue], width, height, fps=None
+    ):
         self._in_queue = in_queue
-        self.photo = ImageTk.PhotoImage(image=self.im)
-        self.photo_next: ImageTk.PhotoImage = None
+        fps = config.preview_fps if fps is None else fps
+        self._interval = max(int(1000 / fps), _MIN_INTERVAL_MS) if fps > 0 else _MIN_INTERVAL_MS
+        self._after_id = None
+        self.photo = ImageTk.PhotoImage(Image.new("RGBA", (width, height)))
         super().__init__(master, image=self.photo)
 
-    async def run(self):
-        while self.running:
-            if self._in_queue.empty():
-                await sleep(0.01)
-                continue
-            self.im = self._in_queue.get()
-            self.im = Image.fromarray(self.im)
-            if self.photo:
-                self.photo_next = ImageTk.PhotoImage(image=self.im)
-                self.configure(image=self.photo_next)
-                self.photo = None
-            else:
-                self.photo = ImageTk.PhotoImage(image=self.im)
-                self.configure(image=self.photo)
-                self.photo_next = None
-            await sleep(0.01)
-        self.run_end()
+    def loop_start(self):
+        if self._after_id is None and self._in_queue is not None:
+            self._after_id = self.after(self._interval, self._refresh)
+
+    def loop_stop(self):
+        if self._after_id is not None:
+            self.after_cancel(self._after_id)
+            self._after_id = None
+
+    def _refresh(self):
+        frame = self._newest()
+        if frame is not None:
+            self._show(frame)
+        self._after_id = self.after(self._interval, self._refresh)
+
+    def _newest(self):
+        frame = None
+        if isinstance(self._in_queue, LatestValue):
+            if not self._in_queue.empty():
+                frame = self._in_queue.get()
+            return frame
+        try:
+            while True:
+                frame = self._in_queue.get_nowait()
+        except Empty:
+            return frame
+
+    def _show(self, frame: np.ndarray):
+        im = Image.fromarray(frame)
+        if im.size != (self.photo.width(), self.photo.height()):
+            self.photo = ImageTk.PhotoImage(Image.new("RGBA", im.size))
+            self.configure(image=self.photo)
+        self.photo.paste(im)
 
 
 def run():
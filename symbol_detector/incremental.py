@@ -0,0 +1,83 @@
+import numpy as np
+
+from symbol_detector.core import draw_standard
+from symbol_detector.matcher import TemplateMatcher
+
+
+class IncrementalRecognizer:
+    """Scores a block while it is being drawn, to send it to recognition early
+
+    After `min_points` points the points so far are drawn with draw_standard,
+    like the final recognition draws the block, and scored against the
+    templates whenever the pointer stood still (the last `interval` points
+    within `still_px`) or, with still_px = 0, at every `interval`-th point.
+    The scoring uses the matcher's cascade or index like the recognition.
+    The block is ready when the best symbol scored under `max_error` with at
+    least `margin` less than any other symbol two scorings in a row. A larger
+    margin means fewer false early decisions but later ones. Waiting for the
+    pointer to stop keeps a symbol which starts like another one (L like I)
+    from being cut short.
+    """
+
+    def __init__(
+        self,
+        matcher: TemplateMatcher,
+        image_size: int,
+        max_error: float,
+        margin: float,
+        interval=5,
+        min_points=10,
+        still_px=3,
+    ):
+        self.set_matcher(matcher)
+        self._image_size = image_size
+        self.max_error = max_error
+        self.margin = margin
+        self._interval = max(1, interval)
+        self._min_points = min_points
+        self._still_px = still_px
+        self._recent = np.zeros([self._interval, 2], np.int32)
+        self._points = list()
+        self._count = 0
+        self._candidate = None
+        self.label = None
+        self.diff = None
+
+    def set_matcher(self, matcher: TemplateMatcher):
+        """Scores against another version of the templates from the next scoring"""
+        self._matcher = matcher
+
+    def reset(self):
+        self._points = list()
+        self._count = 0
+        self._candidate = None
+        self.label = None
+        self.diff = None
+
+    def add(self, point) -> bool:
+        """Adds a point, returns True when the block can be recognized"""
+        self._points.append(point)
+        self._recent[self._count % self._interval] = point[0], point[1]
+        self._count += 1
+        if self._count < self._min_points:
+            return False
+        if self._still_px:
+            if np.ptp(self._recent, axis=0).max() > self._still_px:
+                self._candidate = None
+                return False
+        elif self._count % self._interval:
+            return False
+        return self._decide()
+
+    def _decide(self) -> bool:
+        matcher = self._matcher
+        if not len(matcher):
+            return False
+        im = matcher.normalizer(draw_standard(self._points, self._image_size))
+        best, diff, other = matcher.best_cos_apart(im, self.margin)
+        label = matcher.labels[best]
+        confident = diff < self.max_error and other - diff >= self.margin
+        ready = confident and label == self._candidate
+        self._candidate = label if confident else None
+        self.label, self.diff = str(label), diff
+        return ready
@@ -0,0 +1,134 @@
+"""Nearest-neighbor index over the templates of a symbol set
+
+Templates are scaled to unit length, so the cosine error is proportional to
+the squared euclidean distance, and projected on the main components of a
+PCA fitted on the set. The distance of two projections is never larger than
+the distance of the templates, so candidates are taken by their projected
+distance and reranked exactly until no projection can beat the best template.
+"""
+from zipfile import BadZipFile
+
+import cv2.cv2 as cv2
+import numpy as np
+
+from symbol_detector.files import replace_file
+
+# Fitting the components on a sample keeps the fit fast for large sets
+_FIT_SAMPLES = 512
+# Below this a matrix product beats the tree
+_KDTREE_MIN_TEMPLATES = 4096
+# float32 rounding of the projected distances
+_BOUND_SLACK = 1e-4
+
+
+def _unit_rows(templates, norms):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        units = templates / norms[:, None]
+    return np.nan_to_num(units, nan=0.0, posinf=0.0, neginf=0.0).astype(np.float32)
+
+
+class EmbeddingIndex:
+    def __init__(self, mean, components, embeddings):
+        self.mean = mean
+        self.components = components
+        self.embeddings = embeddings
+        self._sq_norms = np.einsum("ij,ij->i", embeddings, embeddings)
+        self._tree = None
+        if len(embeddings) >= _KDTREE_MIN_TEMPLATES:
+            self._tree = cv2.flann_Index(embeddings, dict(algorithm=1, trees=1))
+
+    @classmethod
+    def fit(cls, templates, norms, dims, seed=0):
+        """Fits the projection to the unit length templates (rows of float32)"""
+        units = _unit_rows(templates, norms)
+        sample = units
+        if len(units) > _FIT_SAMPLES:
+            rng = np.random.default_rng(seed)
+            sample = units[np.sort(rng.choice(len(units), _FIT_SAMPLES, replace=False))]
+        mean = sample.mean(axis=0)
+        centered = sample - mean
+        # Eigenvectors of the small gram matrix give the components
+        eigenvalues, vectors = np.linalg.eigh(centered @ centered.T)
+        order = np.argsort(eigenvalues)[::-1][:dims]
+        order = order[eigenvalues[order] > 1e-6]
+        components = (centered.T @ vectors[:, order]) / np.sqrt(eigenvalues[order])
+        components = np.ascontiguousarray(components.T, np.float32)
+        embeddings = np.ascontiguousarray((units - mean) @ components.T, np.float32)
+        return cls(mean.astype(np.float32), components, embeddings)
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    @property
+    def dims(self):
+        return len(self.components)
+
+    def project(self, unit_image):
+        return (unit_image - self.mean) @ self.components.T
+
+    def lower_bounds(self, embedding):
+        """Lower bounds of the cosine errors (%) of every template"""
+        sq = self._sq_norms - 2.0 * (self.embeddings @ embedding) + float(embedding @ embedding)
+        return 50.0 * np.maximum(sq, 0.0)
+
+    def best(self, gray_image, templates, norms, k=32):
+        """(index, relative cosine error) of the best template, the same as an
+        exhaustive search"""
+        im0 = np.float32(gray_image).ravel()
+        norm0 = float(np.sqrt(im0 @ im0))
+        if norm0 == 0.0 or not len(self):
+            return 0, 100.0
+        embedding = np.float32(self.project(im0 / norm0))
+
+        if self._tree is not None:
+            k = min(k, len(self))
+            indices, dists = self._tree.knnSearch(embedding[None, :], k, params=dict(checks=-1))
+            indices = indices[0]
+            index, diff = _rerank(indices, im0, norm0, templates, norms)
+            if k == len(self) or diff <= 50.0 * float(dists[0, -1]) * (1.0 - _BOUND_SLACK):
+                return index, diff
+
+        bounds = self.lower_bounds(embedding)
+        order = np.argsort(bounds, kind="stable")
+        best_index, best_diff = -1, np.inf
+        for start in range(0, len(order), k):
+            chunk = order[start: start + k]
+            if bounds[chunk[0]] * (1.0 - _BOUND_SLACK) > best_diff:
+                break
+            index, diff = _rerank(chunk, im0, norm0, templates, norms)
+            if diff < best_diff or (diff == best_diff and index < best_index):
+                best_index, best_diff = index, diff
+        return best_index, best_diff
+
+    def save(self, path, key: str):
+        """Saves the projection and the embeddings, `key` identifies the templates"""
+        replace_file(
+            path,
+            lambda file: np.savez(
+                file,
+                key=np.array(key),
+                mean=self.mean,
+                components=self.components,
+                embeddings=self.embeddings,
+            ),
+        )
+
+    @classmethod
+    def load(cls, path, key: str):
+        """Loads a saved index, None if missing, unreadable or saved for other templates"""
+        try:
+            with np.load(path) as data:
+                if str(data["key"]) != key:
+                    return None
+                return cls(data["mean"], data["components"], data["embeddings"])
+        except (OSError, ValueError, KeyError, EOFError, BadZipFile):
+            return None
+
+
+def _rerank(indices, im0, norm0, templates, norms):
+    dots = templates[indices] @ im0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        similarity = np.nan_to_num(dots / (norms[indices] * norm0), nan=0.0)
+    diffs = 100.0 * (1.0 - similarity)
+    best = int(diffs.argmin())
+    return int(indices[best]), float(diffs[best])
@@ -0,0 +1,228 @@
+from hashlib import sha1
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from symbol_detector.index import EmbeddingIndex
+from symbol_detector.normalization import DEFAULT_NORMALIZATION, get_normalizer
+
+_ABS_DIFF_CHUNK = 256
+# float32 rounding of the bounds
+_BOUND_SLACK = 1e-4
+
+
+class TemplateMatcher:
+    """Scores an image against every template of a symbol set at once
+
+    With a `coarse_size` the templates are also kept as coarse_size x
+    coarse_size block means. `best_cos` bounds the cosine similarity of every
+    template from that level and the energy the block means leave out, then
+    rescores at full resolution only the templates whose bound can beat the
+    best one found, `candidates` at a time. The result is the same as the
+    exhaustive search.
+
+    With `index_dims` `best_cos` searches an EmbeddingIndex of that many
+    dimensions instead, saved to and loaded from `index_path` if given.
+
+    `normalizer` is the stage the templates went through, the drawings have to
+    go through it too.
+    """
+
+    def __init__(
+        self,
+        symbols,
+        coarse_size=0,
+        candidates=32,
+        index_dims=0,
+        index_path=None,
+        normalization=DEFAULT_NORMALIZATION,
+    ):
+        self.normalizer = get_normalizer(normalization)
+        self.labels = list()
+        self.images = list()
+        self.file_names = list()
+        for k in symbols.keys():
+            for t in symbols[k]:
+                self.labels.append(k)
+                self.images.append(t[0])
+                self.file_names.append(t[1])
+
+        if self.images:
+            stacked = np.stack([im.ravel() for im in self.images])
+        else:
+            stacked = np.zeros([0, 0], np.uint8)
+        self.templates = np.ascontiguousarray(stacked, np.uint8)
+        self.templates_f32 = np.ascontiguousarray(stacked, np.float32)
+        self.norms = np.sqrt(np.einsum("ij,ij->i", self.templates_f32, self.templates_f32))
+        self._label_array = np.array(self.labels)
+
+        self.coarse_size = coarse_size
+        self.candidates = candidates
+        self.coarse_f32 = None
+        self.residual_norms = None
+        if coarse_size and self.images:
+            self.coarse_f32 = np.stack([block_means(im, coarse_size).ravel() for im in self.images])
+            self.residual_norms = _residual_norms(
+                self.norms, self.coarse_f32, self._block_area(self.images[0])
+            )
+
+        self.index: Optional[EmbeddingIndex] = None
+        if index_dims and len(self) > candidates:
+            self.index = self._load_index(index_dims, index_path)
+
+    def _index_key(self, dims):
+        digest = sha1(self.norms.tobytes())
+        digest.update("\n".join(self.file_names).encode())
+        digest.update(repr(self.normalizer.params).encode())
+        return f"{dims}:{digest.hexdigest()}"
+
+    def _load_index(self, dims, path) -> EmbeddingIndex:
+        key = self._index_key(dims)
+        index = EmbeddingIndex.load(path, key) if path else None
+        if index is None:
+            index = EmbeddingIndex.fit(self.templates_f32, self.norms, dims)
+            if path:
+                try:
+                    Path(path).parent.mkdir(parents=True, exist_ok=True)
+                    index.save(path, key)
+                except OSError:
+                    pass
+        return index
+
+    def _block_area(self, gray_image):
+        return (gray_image.shape[0] // self.coarse_size) * (gray_image.shape[1] // self.coarse_size)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def cos_diffs(self, gray_image):
+        """Relative cosine error of the image against every template"""
+        return _cos_diffs(self.templates_f32, self.norms, np.float32(gray_image).ravel())
+
+    def best_cos(self, gray_image):
+        """(index, relative cosine error) of the best template, from the index or
+        coarse-to-fine if the matcher has one and more templates than candidates"""
+        if self.index is not None:
+            return self.index.best(gray_image, self.templates_f32, self.norms, self.candidates)
+        if self.coarse_f32 is None or len(self) <= self.candidates:
+            diffs = self.cos_diffs(gray_image)
+            index = int(diffs.argmin())
+            return index, float(diffs[index])
+
+        im0 = np.float32(gray_image).ravel()
+        norm0 = float(np.sqrt(im0 @ im0))
+        if norm0 == 0.0:
+            return 0, 100.0
+        upper = self._coarse_upper_bounds(gray_image, norm0)
+        order = np.argsort(-upper, kind="stable")
+
+        best_index, best_similarity = -1, -np.inf
+        for start in range(0, len(order), self.candidates):
+            chunk = order[start: start + self.candidates]
+            if upper[chunk[0]] * (1.0 + _BOUND_SLACK) < best_similarity:
+                break
+            diffs = _cos_diffs(self.templates_f32[chunk], self.norms[chunk], im0)
+            best = int(diffs.argmin())
+            similarity = 1.0 - diffs[best] / 100.0
+            if similarity > best_similarity or (
+                similarity == best_similarity and chunk[best] < best_index
+            ):
+                best_index, best_similarity = int(chunk[best]), similarity
+        return best_index, float(100.0 * (1.0 - best_similarity))
+
+    def _coarse_upper_bounds(self, gray_image, norm0):
+        """Upper bounds of the cosine similarity of every template"""
+        area = self._block_area(gray_image)
+        coarse0 = block_means(gray_image, self.coarse_size).ravel()
+        residual0 = float(np.sqrt(max(norm0 ** 2 - area * float(coarse0 @ coarse0), 0.0)))
+        # The coarse dot product plus the Cauchy-Schwarz bound of the residuals
+        upper = area * (self.coarse_f32 @ coarse0) + self.residual_norms * residual0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.nan_to_num(upper / (self.norms * norm0), nan=0.0)
+
+    def best_cos_apart(self, gray_image, margin):
+        """(index, error, other) of the best template by best_cos, `other` is the
+        error of a template of another symbol within `margin` of the best one,
+        np.inf if there is none
+
+        Only the templates whose index or coarse bound is within the margin
+        are rescored, at full resolution.
+        """
+        im0 = np.float32(gray_image).ravel()
+        if self.index is None and (self.coarse_f32 is None or len(self) <= self.candidates):
+            diffs = _cos_diffs(self.templates_f32, self.norms, im0)
+            index = int(diffs.argmin())
+            other = diffs[self._label_array != self._label_array[index]]
+            diff = float(diffs[index])
+            return index, diff, float(other.min()) if len(other) else np.inf
+        index, diff = self.best_cos(gray_image)
+        limit = diff + margin
+        other = self._label_array != self._label_array[index]
+        norm0 = float(np.sqrt(im0 @ im0))
+        if norm0 == 0.0 or not other.any():
+            return index, diff, np.inf
+        if self.index is not None:
+            bounds = self.index.lower_bounds(np.float32(self.index.project(im0 / norm0)))
+        else:
+            bounds = 100.0 * (1.0 - self._coarse_upper_bounds(gray_image, norm0))
+        candidates = np.flatnonzero(other & (bounds * (1.0 - _BOUND_SLACK) < limit))
+        candidates = candidates[np.argsort(bounds[candidates], kind="stable")]
+        for start in range(0, len(candidates), self.candidates):
+            chunk = candidates[start: start + self.candidates]
+            diffs = _cos_diffs(self.templates_f32[chunk], self.norms[chunk], im0)
+            if diffs.min() < limit:
+                return index, diff, float(diffs.min())
+        return index, diff, np.inf
+
+    def absolute_diffs(self, gray_image, max_diff):
+        """Relative absolute difference of the image against every template"""
+        im0 = np.int16(gray_image).ravel()
+        sums = np.empty(len(self), np.float64)
+        for start in range(0, len(self), _ABS_DIFF_CHUNK):
+            chunk = self.templates[start: start + _ABS_DIFF_CHUNK]
+            sums[start: start + len(chunk)] = np.abs(chunk - im0).sum(axis=1)
+        return 100.0 * sums / max_diff
+
+    def top_k(self, diffs, k):
+        """Indices of the k smallest errors, the best one first"""
+        k = min(k, len(diffs))
+        if k == len(diffs):
+            return np.argsort(diffs, kind="stable")
+        candidates = np.argpartition(diffs, k - 1)[:k]
+        return candidates[np.argsort(diffs[candidates], kind="stable")]
+
+    def result(self, index, diffs):
+        return self.labels[index], self.images[index], float(diffs[index])
+
+    def compare_cos(self, gray_image):
+        diffs = self.cos_diffs(gray_image)
+        return self.result(int(np.argmin(diffs)), diffs)
+
+    def compare_absolute_diff(self, gray_image, max_diff):
+        diffs = self.absolute_diffs(gray_image, max_diff)
+        return self.result(int(np.argmin(diffs)), diffs)
+
+
+def block_means(gray_image, size):
+    """size x size float32 means of equal blocks, the image side must be a multiple of size"""
+    height, width = gray_image.shape[:2]
+    if height % size or width % size:
+        raise ValueError(f"The image size {width}x{height} is not a multiple of {size}")
+    im = np.float32(gray_image).reshape(size, height // size, size, width // size)
+    return im.mean(axis=(1, 3))
+
+
+def _residual_norms(norms, coarse, area):
+    """Norms of the templates minus their block means"""
+    energy = norms.astype(np.float64) ** 2 - area * np.einsum("ij,ij->i", coarse, coarse)
+    return np.float32(np.sqrt(np.maximum(energy, 0.0)))
+
+
+def _cos_diffs(templates, norms, im0):
+    norm0 = float(np.sqrt(im0 @ im0))
+    dots = templates @ im0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        similarity = dots / (norms * norm0)
+    similarity = np.nan_to_num(similarity, nan=0.0)
+    return 100.0 * (1.0 - similarity)
@@ -0,0 +1,191 @@
+import os
+from json import dumps
+from pathlib import Path
+from threading import Lock, Thread, Event
+from time import perf_counter, time
+from typing import Callable, Dict, Union
+
+import numpy as np
+
+from symbol_detector.constants import PERCENTILES
+
+
+class RollingHistogram:
+    """Keeps the last `size` samples of a stage"""
+
+    def __init__(self, size=1024):
+        self._samples = np.zeros(size, np.float64)
+        self._size = size
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value: float):
+        self._samples[self.count % self._size] = value
+        self.count += 1
+        self.total += value
+
+    def summary(self) -> dict:
+        samples = self._samples[: min(self.count, self._size)]
+        if not len(samples):
+            return {"count": 0}
+        values = np.percentile(samples, PERCENTILES)
+        summary = {"count": self.count, "mean": self.total / self.count, "max": float(samples.max())}
+        for p, value in zip(PERCENTILES, values):
+            summary[f"p{p}"] = float(value)
+        return summary
+
+
+class _Timer:
+    __slots__ = ("_metrics", "_stage", "_start")
+
+    def __init__(self, metrics, stage):
+        self._metrics = metrics
+        self._stage = stage
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self._metrics.observe(self._stage, perf_counter() - self._start)
+
+
+class Metrics:
+    """Stage latencies (seconds), counters and gauges of the detection pipeline"""
+
+    def __init__(self, window=1024):
+        self._window = window
+        self._lock = Lock()
+        self._histograms: Dict[str, RollingHistogram] = {}
+        self._counters: Dict[str, int] = {}
+        self._gauges: Dict[str, Union[float, Callable[[], float]]] = {}
+
+    def timer(self, stage: str) -> _Timer:
+        return _Timer(self, stage)
+
+    def labeled(self, **labels) -> "LabeledMetrics":
+        return LabeledMetrics(self, **labels)
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = RollingHistogram(self._window)
+            histogram.add(seconds)
+
+    def increment(self, counter: str, n=1):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + n
+
+    def set_gauge(self, name: str, value: Union[float, Callable[[], float]]):
+        """Sets a value, or a function read at every snapshot"""
+        self._gauges[name] = value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stages = {k: h.summary() for k, h in self._histograms.items()}
+            counters = dict(self._counters)
+        gauges = {k: float(v() if callable(v) else v) for k, v in self._gauges.items()}
+        return {"time": time(), "stages": stages, "counters": counters, "gauges": gauges}
+
+    def to_prometheus(self, prefix="symbol_detector") -> str:
+        snapshot = self.snapshot()
+        # Every family's samples together under one TYPE line, whatever the labels
+        families: Dict[str, tuple] = {}
+
+        def family(name, kind) -> list:
+            if name not in families:
+                families[name] = (kind, list())
+            return families[name][1]
+
+        for key, summary in snapshot["stages"].items():
+            stage, labels = _split_labels(key)
+            name = f"{prefix}_{stage}_seconds"
+            lines = family(name, "summary")
+            for p in PERCENTILES:
+                if f"p{p}" in summary:
+                    quantile = ",".join(filter(None, [labels, f'quantile="{p / 100}"']))
+                    lines.append(f'{name}{{{quantile}}} {summary[f"p{p}"]:.9f}')
+            braces = f"{{{labels}}}" if labels else ""
+            if summary["count"]:
+                lines.append(f"{name}_sum{braces} {summary['mean'] * summary['count']:.9f}")
+            lines.append(f"{name}_count{braces} {summary['count']}")
+        for key, value in snapshot["counters"].items():
+            counter, labels = _split_labels(key)
+            name = f"{prefix}_{counter}_total"
+            braces = f"{{{labels}}}" if labels else ""
+            family(name, "counter").append(f"{name}{braces} {value}")
+        for key, value in snapshot["gauges"].items():
+            gauge, labels = _split_labels(key)
+            name = f"{prefix}_{gauge}"
+            braces = f"{{{labels}}}" if labels else ""
+            family(name, "gauge").append(f"{name}{braces} {value}")
+
+        lines = list()
+        for name, (kind, samples) in families.items():
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: Union[Path, str]):
+        """Writes the metrics atomically, in Prometheus text format for .prom files"""
+        path = Path(path)
+        if path.suffix == ".prom":
+            text = self.to_prometheus()
+        else:
+            text = dumps(self.snapshot(), indent=2)
+        tmp_path = path.with_name(path.name + ".tmp")
+        tmp_path.write_text(text)
+        os.replace(tmp_path, path)
+
+
+def _split_labels(key: str):
+    """'name{a="b"}' -> ('name', 'a="b"')"""
+    if not key.endswith("}"):
+        return key, ""
+    name, labels = key[:-1].split("{", 1)
+    return name, labels
+
+
+class LabeledMetrics:
+    """View of a Metrics which adds labels to every name, e.g. filter_image{source="video0"}"""
+
+    def __init__(self, parent: Metrics, **labels):
+        self._parent = parent
+        self._suffix = "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+    def timer(self, stage: str) -> _Timer:
+        return _Timer(self, stage)
+
+    def observe(self, stage: str, seconds: float):
+        self._parent.observe(stage + self._suffix, seconds)
+
+    def increment(self, counter: str, n=1):
+        self._parent.increment(counter + self._suffix, n)
+
+    def set_gauge(self, name: str, value: Union[float, Callable[[], float]]):
+        self._parent.set_gauge(name + self._suffix, value)
+
+    def snapshot(self) -> dict:
+        return self._parent.snapshot()
+
+
+class MetricsDumper(Thread):
+    """Dumps the metrics to a file periodically"""
+
+    def __init__(self, metrics: Metrics, path: Union[Path, str], interval: float):
+        super().__init__(daemon=True)
+        self._metrics = metrics
+        self._path = path
+        self._interval = interval
+        self._stop_event = Event()
+
+    def run(self):
+        while not self._stop_event.wait(self._interval):
+            self._metrics.dump(self._path)
+        self._metrics.dump(self._path)
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
@@ -0,0 +1,136 @@
+"""Normalization stages, turning a rasterized drawing into the image which is matched
+
+The stage is chosen per symbol set and is part of the template cache key,
+the templates and the drawings of a set always go through the same one.
+"""
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict
+
+import cv2.cv2 as cv2
+import numpy as np
+
+from symbol_detector.constants import BLUR_SIZE, BLUR_CYCLES
+
+BOX = "box"
+GAUSSIAN = "gaussian"
+DISTANCE = "distance"
+NORMALIZATIONS = (BOX, GAUSSIAN, DISTANCE)
+DEFAULT_NORMALIZATION = BOX
+# Distances are looked up in 1/_DISTANCE_STEPS pixels
+_DISTANCE_STEPS = 4
+
+
+class Normalizer:
+    name = ""
+
+    @property
+    def params(self) -> dict:
+        """Everything the output depends on, for the cache key"""
+        return {"name": self.name}
+
+    def __call__(self, gray_image: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+
+class BoxNormalizer(Normalizer):
+    """`cycles` box blurs, stretched to a maximum of 255, the same output as ceil_blur
+
+    The blurs are running sums, cheaper than one pass of the equivalent
+    (size - 1) * cycles + 1 wide kernel.
+    """
+
+    name = BOX
+
+    def __init__(self, size=BLUR_SIZE, cycles=BLUR_CYCLES):
+        self.size = size
+        self.cycles = cycles
+        self._ksize = (size, size)
+        self._steps = np.arange(256, dtype=np.float64)
+
+    @property
+    def params(self):
+        return {"name": self.name, "size": self.size, "cycles": self.cycles}
+
+    def __call__(self, gray_image):
+        image = cv2.blur(gray_image, self._ksize)
+        for _ in range(self.cycles - 1):
+            cv2.blur(image, self._ksize, dst=image)
+        return _stretch_u8(image, self._steps)
+
+
+class GaussianNormalizer(Normalizer):
+    """Gaussian blur stretched to a maximum of 255, by default with the
+    variance of the box cascade"""
+
+    name = GAUSSIAN
+
+    def __init__(self, sigma=None):
+        if sigma is None:
+            sigma = (BLUR_CYCLES * (BLUR_SIZE ** 2 - 1) / 12.0) ** 0.5
+        self.sigma = float(sigma)
+        size = 2 * int(np.ceil(3.0 * self.sigma)) + 1
+        self._kernel = cv2.getGaussianKernel(size, self.sigma, cv2.CV_32F)
+
+    @property
+    def params(self):
+        return {"name": self.name, "sigma": self.sigma}
+
+    def __call__(self, gray_image):
+        image = cv2.sepFilter2D(gray_image, cv2.CV_32F, self._kernel, self._kernel)
+        _, maximum, _, _ = cv2.minMaxLoc(image)
+        if maximum <= 0:
+            return np.zeros(gray_image.shape, np.uint8)
+        return cv2.convertScaleAbs(image, alpha=255.0 / maximum)
+
+
+class DistanceNormalizer(Normalizer):
+    """Soft raster from the distance to the nearest drawn pixel,
+    255 * exp(-d^2 / (2 * sigma^2))"""
+
+    name = DISTANCE
+
+    def __init__(self, sigma=10.0):
+        self.sigma = float(sigma)
+        distances = np.arange(256) / _DISTANCE_STEPS
+        self._falloff = np.uint8(255.0 * np.exp(-(distances ** 2) / (2.0 * self.sigma ** 2)))
+
+    @property
+    def params(self):
+        return {"name": self.name, "sigma": self.sigma}
+
+    def __call__(self, gray_image):
+        _, background = cv2.threshold(gray_image, 0, 255, cv2.THRESH_BINARY_INV)
+        distances = cv2.distanceTransform(background, cv2.DIST_L2, cv2.DIST_MASK_5)
+        steps = cv2.convertScaleAbs(distances, alpha=_DISTANCE_STEPS)
+        return cv2.LUT(steps, self._falloff)
+
+
+def _stretch_u8(image, steps):
+    maximum = int(image.max())
+    if maximum == 0:
+        return image
+    lookup_table = (steps * (255.0 / maximum)).astype(np.uint8)
+    return cv2.LUT(image, lookup_table)
+
+
+_NORMALIZERS = {
+    BOX: BoxNormalizer,
+    GAUSSIAN: GaussianNormalizer,
+    DISTANCE: DistanceNormalizer,
+}
+
+
+@lru_cache(maxsize=None)
+def get_normalizer(name=DEFAULT_NORMALIZATION) -> Normalizer:
+    """The shared normalizer of that name, its kernels are computed once"""
+    try:
+        return _NORMALIZERS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown normalization '{name}', use one of {NORMALIZATIONS}")
+
+
+def normalization_for(symbol_set, choices: Dict[str, str]) -> str:
+    """The normalization of a symbol set (name or directory) from the
+    detecting_options.normalization mapping"""
+    return choices.get(Path(symbol_set).name, DEFAULT_NORMALIZATION)
@@ -0,0 +1,91 @@
+from time import monotonic, process_time
+
+from symbol_detector.metrics import Metrics
+
+
+class FramePacer:
+    """Paces the processing loop against a target frame rate
+
+    After `idle_after` seconds without a pointer it switches to a low-power
+    idle mode: frames are scanned downscaled by `idle_scale` at `idle_fps`.
+    The first frame with a pointer switches back to the full rate. The
+    wake_up latency is the time from the last idle frame without a pointer
+    to the one which found it, the pointer may have gone unseen that long.
+    A target of 0 fps does not sleep, the loop then runs at camera speed.
+    """
+
+    def __init__(
+        self,
+        target_fps: float,
+        idle_fps: float,
+        idle_after: float,
+        idle_scale: float,
+        metrics: Metrics = None,
+    ):
+        self._period = 1.0 / target_fps if target_fps > 0 else 0.0
+        self._idle_period = 1.0 / idle_fps if idle_fps > 0 else self._period
+        self._idle_after = idle_after
+        self._idle_scale = idle_scale
+        self._metrics = metrics if metrics is not None else Metrics()
+        self._metrics.set_gauge("idle", lambda: float(self.idle))
+        self._metrics.set_gauge("idle_cpu_fraction", self.idle_cpu_fraction)
+        self.idle = False
+        self._frame_start = None
+        self._previous_start = None
+        self._last_seen = 0.0
+        self._idle_since = None
+        self._idle_wall = 0.0
+        self._idle_cpu = 0.0
+        self.reset()
+
+    def reset(self):
+        self.idle = False
+        self._last_seen = monotonic()
+        self._frame_start = None
+        self._previous_start = None
+        self._idle_since = None
+
+    @property
+    def scale(self) -> float:
+        return self._idle_scale if self.idle else 1.0
+
+    def frame_started(self):
+        self._previous_start = self._frame_start
+        self._frame_start = monotonic()
+
+    def frame_done(self, found: bool):
+        now = monotonic()
+        if self.idle:
+            self._metrics.increment("low_power_frames")
+        if found:
+            self._last_seen = now
+            if self.idle:
+                self._wake()
+        elif not self.idle and now - self._last_seen >= self._idle_after:
+            self._sleep(now)
+
+    def delay(self) -> float:
+        """Seconds left from the current frame's period"""
+        period = self._idle_period if self.idle else self._period
+        return max(0.0, period - (monotonic() - self._frame_start))
+
+    def _sleep(self, now):
+        self.idle = True
+        self._idle_since = (now, process_time())
+
+    def _wake(self):
+        self.idle = False
+        if self._previous_start is not None:
+            self._metrics.observe("wake_up", self._frame_start - self._previous_start)
+        wall, cpu = self._idle_since
+        self._idle_wall += monotonic() - wall
+        self._idle_cpu += process_time() - cpu
+        self._idle_since = None
+
+    def idle_cpu_fraction(self) -> float:
+        """Process CPU time per wall time spent in idle mode"""
+        wall, cpu = self._idle_wall, self._idle_cpu
+        if self._idle_since is not None:
+            wall += monotonic() - self._idle_since[0]
+            cpu += process_time() - self._idle_since[1]
+        return cpu / wall if wall > 0 else 0.0
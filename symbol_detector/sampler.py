@@ -12,11 +12,153 @@
 # middle click : calculating filter parameters
 #
 
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Iterable, Tuple
+
 from symbol_detector import core
 import numpy as np
+from symbol_detector.core import FilterProperty, Segmenter
 from symbol_detector.settings import config
 import cv2.cv2 as cv2
 
+BURST_FRAMES = 150
+SCORE_FRAMES = 30
+# Percent of the samples cut off at both ends of each channel's range
+TRIMS = (0.0, 0.5, 1.0, 2.0, 5.0)
+SINGLE_FRAME_TRIM = 1.0
+
+
+@dataclass
+class Calibration:
+    filter_property: FilterProperty
+    trim: float
+    hit_rate: float
+    false_blobs: float
+    frames: int
+    seconds: float
+
+
+def robust_ranges(samples: np.ndarray, trim: float) -> np.ndarray:
+    """[[min, max]] of the Y, Cr, Cb channels of (n, 3) uint8 samples,
+    without the lowest and highest `trim` percent of each channel"""
+    n = len(samples)
+    offsets = np.arange(3) * 256
+    hist = np.bincount((samples.astype(np.intp) + offsets).ravel(), minlength=768)
+    cum = np.cumsum(hist.reshape(3, 256), axis=1)
+    cut = n * trim / 100.0
+    ranges = np.empty([3, 2], np.int64)
+    for c in range(3):
+        ranges[c, 0] = np.searchsorted(cum[c], cut, side="right")
+        ranges[c, 1] = np.searchsorted(cum[c], n - cut, side="left")
+    return ranges
+
+
+def filter_from_ranges(ranges: np.ndarray, blur: int) -> FilterProperty:
+    (y_min, y_max), (cr_min, cr_max), (cb_min, cb_max) = ranges.tolist()
+    return FilterProperty(y_min, y_max, cb_min, cb_max, cr_min, cr_max, blur)
+
+
+def score_filter(
+    y_cr_cb_frames: Iterable[np.ndarray],
+    fp: FilterProperty,
+    center: Tuple[int, int],
+    radius: int,
+    area_min: float,
+    area_max: float,
+) -> Tuple[float, float]:
+    """(hit rate, false blobs per frame) of a filter on blurred YCrCb frames
+
+    A hit is a frame with a pointer sized blob inside the circle, a false blob
+    is a pointer sized blob outside of it, one which capture_point could take
+    for the pointer.
+    """
+    segmenter = Segmenter(fp)
+    frames = hits = false_blobs = 0
+    for y_cr_cb in y_cr_cb_frames:
+        frames += 1
+        thresh = segmenter.threshold(y_cr_cb)
+        cnts, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        hit = False
+        for cnt in cnts:
+            area = cv2.contourArea(cnt)
+            if not area_min < area < area_max:
+                continue
+            (x, y), _ = cv2.minEnclosingCircle(cnt)
+            if (x - center[0]) ** 2 + (y - center[1]) ** 2 <= radius ** 2:
+                hit = True
+            else:
+                false_blobs += 1
+        hits += hit
+    if not frames:
+        return 0.0, 0.0
+    return hits / frames, false_blobs / frames
+
+
+def calibrate(
+    frames: Iterable[np.ndarray],
+    n_frames: int,
+    center: Tuple[int, int],
+    radius: int,
+    blur: int,
+    area_min: float,
+    area_max: float,
+    score_frames=SCORE_FRAMES,
+) -> Calibration:
+    """Derives the filter from the pixels inside the circle on a burst of mirrored
+    BGR frames, with the pointer held in the circle
+
+    Every trim of TRIMS is scored on `score_frames` evenly spaced frames of the
+    burst, the one with the highest hit rate minus false blobs per frame wins,
+    on a tie the least trimmed. `seconds` doesn't include waiting for frames.
+    """
+    seconds = 0.0
+    samples = None
+    step = max(1, n_frames // score_frames)
+    kept = []
+    count = 0
+    for frame in frames:
+        if count == n_frames:
+            break
+        started = perf_counter()
+        if samples is None:
+            # Only the circle is converted, except on the frames kept for scoring,
+            # padded to blur it like the whole frame
+            pad = blur // 2 + 1
+            height, width = frame.shape[:2]
+            x0, y0 = max(0, center[0] - radius - pad), max(0, center[1] - radius - pad)
+            x1 = min(width, center[0] + radius + pad + 1)
+            y1 = min(height, center[1] + radius + pad + 1)
+            mask = np.zeros([y1 - y0, x1 - x0], np.uint8)
+            cv2.circle(mask, (center[0] - x0, center[1] - y0), radius, 255, -1)
+            ys, xs = np.nonzero(mask)
+            samples = np.empty([n_frames, len(ys), 3], np.uint8)
+        if count % step == 0:
+            y_cr_cb = cv2.cvtColor(cv2.blur(frame, (blur, blur)), cv2.COLOR_BGR2YCrCb)
+            kept.append(y_cr_cb)
+            y_cr_cb = y_cr_cb[y0:y1, x0:x1]
+        else:
+            crop = cv2.blur(frame[y0:y1, x0:x1], (blur, blur))
+            y_cr_cb = cv2.cvtColor(crop, cv2.COLOR_BGR2YCrCb)
+        samples[count] = y_cr_cb[ys, xs]
+        count += 1
+        seconds += perf_counter() - started
+    if not count:
+        raise ValueError("No frames to calibrate from")
+    started = perf_counter()
+    samples = samples[:count].reshape(-1, 3)
+
+    best = None
+    for trim in TRIMS:
+        fp = filter_from_ranges(robust_ranges(samples, trim), blur)
+        hit_rate, false_blobs = score_filter(kept, fp, center, radius, area_min, area_max)
+        key = hit_rate - false_blobs
+        if best is None or key > best[0]:
+            best = (key, Calibration(fp, trim, hit_rate, false_blobs, count, 0.0))
+    result = best[1]
+    result.seconds = seconds + perf_counter() - started
+    return result
+
 
 class Sampler:
     def __init__(self):
@@ -52,9 +194,7 @@ class Sampler:
             self._radius = int((dx ** 2 + dy ** 2) ** 0.5)
         elif event == cv2.EVENT_MBUTTONDOWN:
             cv2.circle(self.im_show, self._CP, self._radius, (0, 0, 255), 1)
-            self._map = np.zeros(
-                [self.im_show.shape[0], self.im_show.shape[1], 1], np.uint8
-            )
+            self._map = np.zeros([self.im_show.shape[0], self.im_show.shape[1]], np.uint8)
             cv2.circle(self._map, self._CP, self._radius, 255, -1)
             self._points = core.my_contour(self._map)
             self._calc_params(self.im_y_cr_cb, self._points)
@@ -117,6 +257,8 @@ class Sampler:
                 if cam.get(cv2.CAP_PROP_EXPOSURE) == future_value:
                     self._exposure = future_value
                 print(self._exposure)
+            elif k == ord("c"):
+                self._calibrate(cam)
             elif k == ord("s"):
                 cv2.imwrite("out.jpg", self.im_show)
             self.im_y_cr_cb = cv2.cvtColor(self.im_show, cv2.COLOR_BGR2YCrCb)
@@ -137,30 +279,47 @@ class Sampler:
         config.save()
 
     def _calc_params(self, image, points):
-        im = image.copy()
-        y = list()
-        cr = list()
-        cb = list()
-        for p in points[0]:
-            y.append(im[p[1], p[0], 0])
-            cr.append(im[p[1], p[0], 1])
-            cb.append(im[p[1], p[0], 2])
-        y.sort()
-        cr.sort()
-        cb.sort()
-        y_min = y[0]
-        y_max = y[len(y) - 1]
-        cr_min = cr[0]
-        cr_max = cr[len(cr) - 1]
-        cb_min = cb[0]
-        cb_max = cb[len(cb) - 1]
+        samples = image[points[0][:, 1], points[0][:, 0]]
+        ranges = robust_ranges(samples, SINGLE_FRAME_TRIM)
+        self._set_ret(filter_from_ranges(ranges, self._blur))
+
+    def _calibrate(self, cam):
+        if self._CP is None or self._radius is None:
+            print("Mark the circle first")
+            return
+        print(f"Hold the pointer in the circle, capturing {BURST_FRAMES} frames")
+        result = calibrate(
+            self._read_burst(cam),
+            BURST_FRAMES,
+            self._CP,
+            self._radius,
+            self._blur,
+            config.area_min,
+            config.area_max,
+        )
+        print(
+            f"{result.frames} frames in {result.seconds:.3f} s, trim {result.trim}%: "
+            f"hit rate {result.hit_rate:.2f}, false blobs {result.false_blobs:.2f} / frame"
+        )
+        self._set_ret(result.filter_property)
+        cv2.circle(self.im_show, self._CP, self._radius, (0, 0, 255), 1)
+
+    @staticmethod
+    def _read_burst(cam):
+        while True:
+            ret, frame = cam.read()
+            if not ret:
+                return
+            yield cv2.flip(frame, 1)
+
+    def _set_ret(self, fp: FilterProperty):
         self._ret = {
             "blur": self._blur,
             "exposure": self._exposure,
-            "y_min": y_min,
-            "y_max": y_max,
-            "cr_min": cr_min,
-            "cr_max": cr_max,
-            "cb_min": cb_min,
-            "cb_max": cb_max,
+            "y_min": fp.y_min,
+            "y_max": fp.y_max,
+            "cr_min": fp.cr_min,
+            "cr_max": fp.cr_max,
+            "cb_min": fp.cb_min,
+            "cb_max": fp.cb_max,
         }
@@ -1,9 +1,10 @@
 import os
 from json import loads, dumps
 from pathlib import Path
-from typing import Union
+from threading import Thread, Event, Lock
+from typing import Callable, Dict, List, Optional, Union
 import numpy as np
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from pydantic.fields import Field
 
 from symbol_detector.constants import DEFAULT_CONFIG_PATH
@@ -35,6 +36,7 @@ class CameraAttribute:
     camera_exposure: int
     camera_width: int
     camera_height: int
+    camera_drivers: List[str]
 
 
 CameraModel = type(
@@ -46,6 +48,7 @@ CameraModel = type(
         "camera_exposure": Field(alias="exposure"),
         "camera_width": Field(alias="width"),
         "camera_height": Field(alias="height"),
+        "camera_drivers": Field([], alias="drivers"),
     },
 )
 
@@ -53,12 +56,112 @@ CameraModel = type(
 class DetectingOptionsAttribute:
     max_rel_error: float
     symbol_set: str
+    executor: str
+    workers: int
+    tracking: bool
+    cascade_size: int
+    cascade_candidates: int
+    recognizer: str
+    max_trajectory_error: float
+    index_dims: int
+    early_commit: bool
+    early_margin: float
+    early_interval: int
+    early_min_points: int
+    early_still_px: int
+    reload_interval: float
+    normalization: Dict[str, str]
 
 
 DetectingOptionsModel = type(
     "DetectingOptionsModel",
     (BaseModel,),
-    {"__annotations__": DetectingOptionsAttribute.__annotations__}
+    {
+        "__annotations__": DetectingOptionsAttribute.__annotations__,
+        "executor": "inline",
+        "workers": 0,
+        "tracking": False,
+        "cascade_size": 30,
+        "cascade_candidates": 32,
+        "recognizer": "image",
+        "max_trajectory_error": 6.0,
+        "index_dims": 0,
+        "early_commit": False,
+        "early_margin": 10.0,
+        "early_interval": 5,
+        "early_min_points": 10,
+        "early_still_px": 3,
+        "reload_interval": 1.0,
+        "normalization": {},
+    },
+)
+
+
+class PreviewAttribute:
+    preview_width: int
+    preview_height: int
+    preview_fps: float
+
+
+PreviewModel = type(
+    "PreviewModel",
+    (BaseModel,),
+    {
+        "__annotations__": PreviewAttribute.__annotations__,
+        "preview_width": Field(640, alias="width"),
+        "preview_height": Field(480, alias="height"),
+        "preview_fps": Field(15.0, alias="fps"),
+    },
+)
+
+
+class PacingAttribute:
+    pacing_target_fps: float
+    pacing_idle_fps: float
+    pacing_idle_after: float
+    pacing_idle_scale: float
+
+
+PacingModel = type(
+    "PacingModel",
+    (BaseModel,),
+    {
+        "__annotations__": PacingAttribute.__annotations__,
+        "pacing_target_fps": Field(40.0, alias="target_fps"),
+        "pacing_idle_fps": Field(5.0, alias="idle_fps"),
+        "pacing_idle_after": Field(5.0, alias="idle_after"),
+        "pacing_idle_scale": Field(0.5, alias="idle_scale"),
+    },
+)
+
+
+class MetricsAttribute:
+    metrics_file: str
+    metrics_interval: float
+
+
+MetricsModel = type(
+    "MetricsModel",
+    (BaseModel,),
+    {
+        "__annotations__": MetricsAttribute.__annotations__,
+        "metrics_file": Field("", alias="file"),
+        "metrics_interval": Field(10.0, alias="interval"),
+    },
+)
+
+
+class RecordingAttribute:
+    recording_trace_file: str
+
+
+RecordingModel = type(
+    "RecordingModel",
+    (BaseModel,),
+    {
+        "__annotations__": RecordingAttribute.__annotations__,
+        "recording_trace_file": Field("", alias="trace_file"),
+    },
 )
 
 
@@ -66,42 +169,130 @@ class SettingsModel(BaseModel):
     filtering_parameters: FilteringParametersModel
     camera: CameraModel
     detecting_options: DetectingOptionsModel
+    preview: PreviewModel = PreviewModel()
+    metrics: MetricsModel = MetricsModel()
+    pacing: PacingModel = PacingModel()
+    recording: RecordingModel = RecordingModel()
 
 
-class Config(FilteringParametersAttribute, CameraAttribute, DetectingOptionsAttribute):
+class Config(
+    FilteringParametersAttribute,
+    CameraAttribute,
+    DetectingOptionsAttribute,
+    PreviewAttribute,
+    MetricsAttribute,
+    PacingAttribute,
+    RecordingAttribute,
+):
     def __init__(self, file: Union[Path, str]):
         self._file: Path = Path(file).resolve() if isinstance(file, str) else file
         self._model: SettingsModel = ...
+        self._snapshot: Optional[ConfigSnapshot] = None
+        self._lock = Lock()
 
     def load(self):
         text = self._file.read_text()
-        self._model = SettingsModel(**loads(text))
+        self._set_model(SettingsModel(**loads(text)))
 
     def save(self):
         data = self._model.dict(by_alias=True)
         json_ = dumps(data, default=_default, indent=2)
         self._file.write_text(json_)
 
+    def snapshot(self) -> "ConfigSnapshot":
+        """Immutable copy of the current settings, replaced on every change"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = ConfigSnapshot(self._model)
+                snapshot = self._snapshot
+        return snapshot
+
+    def _set_model(self, model: SettingsModel):
+        with self._lock:
+            self._model = model
+            self._snapshot = None
+
     def __getattr__(self, item: str):
         if item.startswith("_"):
             return super().__getattribute__(item)
 
-        model_name = self._get_model_name(item)
-        model = getattr(self._model, model_name)
-        return getattr(model, item)
+        model_name = _ATTRIBUTE_MODEL_NAMES.get(item)
+        if model_name is None:
+            raise AttributeError(item)
+        return getattr(getattr(self._model, model_name), item)
 
     def __setattr__(self, key: str, value):
         if key.startswith("_"):
             return super().__setattr__(key, value)
 
-        model_name = self._get_model_name(key)
+        model_name = _ATTRIBUTE_MODEL_NAMES.get(key)
+        if model_name is None:
+            raise AttributeError(key)
         model = getattr(self._model, model_name)
-        setattr(model, key, value)
+        with self._lock:
+            setattr(model, key, value)
+            self._snapshot = None
+
+
+class _ConfigSnapshotBase:
+    __slots__ = ()
+
+    def __init__(self, model: SettingsModel):
+        for name, model_name in _ATTRIBUTE_MODEL_NAMES.items():
+            value = getattr(getattr(model, model_name), name)
+            object.__setattr__(self, name, tuple(value) if isinstance(value, list) else value)
 
-    def _get_model_name(self, item: str) -> str:
-        for base in self.__class__.__bases__:
-            if item in base.__annotations__.keys():
-                return _CLASS_MODEL_NAME_MAP[base]
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+
+class ConfigWatcher(Thread):
+    """Reloads the settings file when its modification time changes
+
+    A file which doesn't parse or validate is reported and skipped, the
+    previous settings stay in effect.
+    """
+
+    def __init__(self, config: Config, interval=1.0, on_change: Callable[[], None] = None):
+        super().__init__(daemon=True)
+        self._config = config
+        self._interval = interval
+        self._on_change = on_change
+        self._stop_event = Event()
+        self._mtime = self._read_mtime()
+
+    def _read_mtime(self):
+        try:
+            return self._config._file.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def run(self):
+        while not self._stop_event.wait(self._interval):
+            self.check()
+
+    def check(self) -> bool:
+        """Reloads the file if it changed, returns True if the settings were replaced"""
+        mtime = self._read_mtime()
+        if mtime is None or mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        try:
+            model = SettingsModel(**loads(self._config._file.read_text()))
+        except (OSError, ValueError, ValidationError) as error:
+            print(f"Settings not reloaded: {error}")
+            return False
+        self._config._set_model(model)
+        if self._on_change:
+            self._on_change()
+        return True
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
 
 
 def _default(obj):
@@ -115,6 +306,24 @@ _CLASS_MODEL_NAME_MAP = {
     FilteringParametersAttribute: "filtering_parameters",
     CameraAttribute: "camera",
     DetectingOptionsAttribute: "detecting_options",
+    PreviewAttribute: "preview",
+    MetricsAttribute: "metrics",
+    PacingAttribute: "pacing",
+    RecordingAttribute: "recording",
+}
+
+_ATTRIBUTE_MODEL_NAMES = {
+    name: model_name
+    for base, model_name in _CLASS_MODEL_NAME_MAP.items()
+    for name in base.__annotations__
 }
+ConfigSnapshot = type(
+    "ConfigSnapshot",
+    (_ConfigSnapshotBase,),
+    {
+        "__doc__": "Read-only settings for the hot paths, plain slot reads instead of the lookups of Config",
+        "__slots__": tuple(_ATTRIBUTE_MODEL_NAMES),
+    },
+)
 
 config = Config(os.getenv("CONFIG_FILE_PATH", f"{DEFAULT_CONFIG_PATH}"))
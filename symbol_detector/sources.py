@@ -0,0 +1,249 @@
+import os
+from pathlib import Path
+from typing import List, Optional, Sequence
+
+import cv2.cv2 as cv2
+import numpy as np
+
+from symbol_detector.core import FilterProperty
+from symbol_detector.settings import config
+
+_IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+class FrameSource:
+    """Provides the frames for FrameProcessor"""
+
+    realtime = True
+
+    def __init__(self, name: str):
+        self.name = name
+        self.shape = None
+
+    def open(self):
+        """(Re)starts the source from its first frame"""
+        raise NotImplementedError
+
+    def read(self):
+        """Returns (ret, frame) like cv2.VideoCapture.read"""
+        raise NotImplementedError
+
+    def read_into(self, out: np.ndarray):
+        """Reads the next frame into a preallocated array"""
+        ret, frame = self.read()
+        if ret:
+            np.copyto(out, frame)
+        return ret, out
+
+    def release(self):
+        pass
+
+    def is_opened(self) -> bool:
+        raise NotImplementedError
+
+
+class CameraSource(FrameSource):
+    """Live camera"""
+
+    def __init__(self, driver, exposure=None, width=None, height=None):
+        super().__init__(Path(str(driver)).name)
+        self.driver = driver
+        self.exposure = exposure
+        self.width = width
+        self.height = height
+        self._cam = None
+
+    @classmethod
+    def from_config(cls, driver=None):
+        return cls(
+            driver if driver is not None else config.camera_driver,
+            config.camera_exposure,
+            config.camera_width,
+            config.camera_height,
+        )
+
+    def open(self):
+        self._cam = cv2.VideoCapture(self.driver)
+        self._cam.set(cv2.CAP_PROP_AUTO_EXPOSURE, 1)
+        if self.exposure is not None:
+            self._cam.set(cv2.CAP_PROP_EXPOSURE, self.exposure)
+        if self.width is not None:
+            self._cam.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        if self.height is not None:
+            self._cam.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        ret, frame = self._cam.read()
+        self.shape = frame.shape
+
+    def read(self):
+        return self._cam.read()
+
+    def read_into(self, out: np.ndarray):
+        ret, frame = self._cam.read(out)
+        if ret and frame is not out:
+            np.copyto(out, frame)
+        return ret, out
+
+    def release(self):
+        if self._cam is not None and self._cam.isOpened():
+            self._cam.release()
+
+    def is_opened(self) -> bool:
+        return self._cam is not None and self._cam.isOpened()
+
+
+def camera_sources_from_config() -> List[CameraSource]:
+    """One source per camera.drivers entry, or the single camera.driver"""
+    drivers = config.camera_drivers or [config.camera_driver]
+    return [CameraSource.from_config(driver) for driver in drivers]
+
+
+class VideoFileSource(FrameSource):
+    """Recorded video file, played as fast as possible unless realtime is set"""
+
+    def __init__(self, path, loop=False, realtime=False):
+        super().__init__(Path(path).stem)
+        self.path = str(path)
+        self.loop = loop
+        self.realtime = realtime
+        self._cap = None
+
+    def open(self):
+        self._cap = cv2.VideoCapture(self.path)
+        if not self._cap.isOpened():
+            raise FileNotFoundError(self.path)
+        width = int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.shape = (height, width, 3)
+
+    def read(self):
+        ret, frame = self._cap.read()
+        if not ret and self.loop:
+            self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self._cap.read()
+        if not ret:
+            self.release()
+        return ret, frame
+
+    def release(self):
+        if self._cap is not None and self._cap.isOpened():
+            self._cap.release()
+
+    def is_opened(self) -> bool:
+        return self._cap is not None and self._cap.isOpened()
+
+
+class DirectorySource(FrameSource):
+    """Directory of frame images, read in file name order"""
+
+    def __init__(self, directory, loop=False, realtime=False):
+        super().__init__(Path(directory).name)
+        self.directory = str(directory)
+        self.loop = loop
+        self.realtime = realtime
+        self._files: List[str] = list()
+        self._i = 0
+
+    def open(self):
+        self._files = sorted(
+            os.path.join(self.directory, file)
+            for file in os.listdir(self.directory)
+            if file.lower().endswith(_IMAGE_SUFFIXES)
+        )
+        if not self._files:
+            raise FileNotFoundError(f"No frames in {self.directory}")
+        self._i = 0
+        self.shape = cv2.imread(self._files[0]).shape
+
+    def read(self):
+        if self._i >= len(self._files) and self.loop:
+            self._i = 0
+        if self._i >= len(self._files):
+            return False, None
+        frame = cv2.imread(self._files[self._i])
+        self._i += 1
+        return frame is not None, frame
+
+    def is_opened(self) -> bool:
+        return bool(self._files) and (self.loop or self._i < len(self._files))
+
+
+class SyntheticSource(FrameSource):
+    """Renders a bright pointer moving along the given strokes
+
+    Stroke coordinates are given in the detector's (mirrored) coordinate system,
+    so the detected points follow the strokes. Each stroke is followed by
+    `gap` empty frames, which closes the block in FrameProcessor.
+    """
+
+    def __init__(
+        self,
+        strokes: Sequence[Sequence[Sequence[float]]],
+        shape=(480, 640, 3),
+        color=(255, 255, 255),
+        radius=8,
+        step=4.0,
+        gap=15,
+        repeat=1,
+        realtime=False,
+        name="synthetic",
+    ):
+        super().__init__(name)
+        self.strokes = [np.array(stroke, np.float64) for stroke in strokes]
+        self.shape = tuple(shape)
+        self.color = tuple(int(c) for c in color)
+        self.radius = radius
+        self.step = step
+        self.gap = gap
+        self.repeat = repeat
+        self.realtime = realtime
+        self._positions: List[Optional[np.ndarray]] = list()
+        self._i = 0
+        self._frame = np.zeros(self.shape, np.uint8)
+
+    @classmethod
+    def from_filter_property(cls, strokes, fp: FilterProperty, **kwargs):
+        """Pointer colored in the middle of the filter's YCrCb ranges"""
+        y_cr_cb = np.array(
+            [[[
+                (fp.y_min + fp.y_max) // 2,
+                (fp.cr_min + fp.cr_max) // 2,
+                (fp.cb_min + fp.cb_max) // 2,
+            ]]],
+            np.uint8,
+        )
+        color = cv2.cvtColor(y_cr_cb, cv2.COLOR_YCrCb2BGR)[0, 0]
+        return cls(strokes, color=color, **kwargs)
+
+    def open(self):
+        positions = list()
+        for _ in range(self.repeat):
+            for stroke in self.strokes:
+                positions.extend(self._interpolate(stroke))
+                positions.extend([None] * self.gap)
+        self._positions = positions
+        self._i = 0
+
+    def _interpolate(self, stroke):
+        if len(stroke) < 2:
+            return list(stroke)
+        positions = list()
+        for p0, p1 in zip(stroke[:-1], stroke[1:]):
+            n = max(1, int(np.ceil(np.linalg.norm(p1 - p0) / self.step)))
+            for t in np.arange(n) / n:
+                positions.append(p0 + (p1 - p0) * t)
+        positions.append(stroke[-1])
+        return positions
+
+    def read(self):
+        if self._i >= len(self._positions):
+            return False, None
+        position = self._positions[self._i]
+        self._i += 1
+        frame = self._frame.copy()
+        if position is not None:
+            center = (self.shape[1] - 1 - int(round(position[0])), int(round(position[1])))
+            cv2.circle(frame, center, self.radius, self.color, -1)
+        return True, frame
+
+    def is_opened(self) -> bool:
+        return self._i < len(self._positions)
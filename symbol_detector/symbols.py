@@ -1,7 +1,21 @@
 import os
+from json import loads, dumps
+from pathlib import Path
+from threading import Lock, Thread
+from typing import Callable, List
+
 import cv2.cv2 as cv2
+import numpy as np
+
 from symbol_detector import core
-from symbol_detector.constants import BASE_DIR
+from symbol_detector.constants import BASE_DIR, CACHE_DIR
+from symbol_detector.files import replace_file
+from symbol_detector.normalization import DEFAULT_NORMALIZATION, get_normalizer
+from symbol_detector.trajectory import N_POINTS, load_trajectory, trajectory_path
+
+_CACHE_VERSION = 3
+_SYMBOL_SUFFIX = ".png"
+INDEX_FILE = "index.npz"
 
 
 def get_next_nr(symbol_name, symbols):
@@ -18,18 +32,234 @@ def get_next_nr(symbol_name, symbols):
         return 1
 
 
-def read_symbols(directory, size):
+def read_symbols(directory, size, normalization=DEFAULT_NORMALIZATION, cache=True):
+    """{symbol: [(template image, file name, trajectory)]}, without `cache`
+    every template is processed and the cache is left as it is"""
+    directory = os.path.join(BASE_DIR, directory)
+    files = list_symbol_files(directory)
+    if cache:
+        images, trajectories = _load_templates(directory, files, size, normalization)
+    else:
+        paths = [os.path.join(directory, file) for file in files]
+        images = [preprocess_symbol(path, size, normalization) for path in paths]
+        trajectories = [load_trajectory(path) for path in paths]
+    return _group(zip(images, files, trajectories))
+
+
+def _group(templates):
+    """{symbol: [template]} of (image, file name, trajectory) tuples sorted by file name"""
     symbols = {}
-    encoded_files = os.listdir(directory.encode("utf-8"))
-    files = [str(file, "utf-8") for file in encoded_files]
-    for file in files:
-        i = file.find("-")
-        key = file[:i]
-        im0 = cv2.imread(os.path.join(BASE_DIR, directory, file))
-        im = cv2.cvtColor(im0, cv2.COLOR_BGR2GRAY)
-        im = core.resize_to_standard(im, size)
-        im = core.ceil_blur(im, 15, 3)
+    for template in templates:
+        key = symbol_name(template[1])
         if not symbols.get(key):
             symbols[key] = list()
-        symbols[key].append((im, file))
+        symbols[key].append(template)
     return symbols
+
+
+def symbol_name(file_name):
+    """The symbol of a template file, <symbol>-<number>.png"""
+    return file_name[: file_name.find("-")]
+
+
+def list_symbol_files(directory):
+    return sorted(
+        file for file in os.listdir(directory) if file.lower().endswith(_SYMBOL_SUFFIX)
+    )
+
+
+def preprocess_symbol(path, size, normalization=DEFAULT_NORMALIZATION):
+    im0 = cv2.imread(path)
+    im = cv2.cvtColor(im0, cv2.COLOR_BGR2GRAY)
+    im = core.resize_to_standard(im, size)
+    return get_normalizer(normalization)(im)
+
+
+def get_cache_dir(directory) -> Path:
+    return CACHE_DIR / Path(directory).name
+
+
+def _mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _load_templates(directory, files, size, normalization):
+    """Returns the preprocessed templates and their trajectories,
+    reprocessing only the changed files"""
+    if not files:
+        return [], []
+    cache_dir = get_cache_dir(directory)
+    manifest_path = cache_dir / "manifest.json"
+    data_path = cache_dir / "templates.npy"
+    trajectories_path = cache_dir / "trajectories.npy"
+    params = {
+        "version": _CACHE_VERSION,
+        "size": size,
+        "normalization": get_normalizer(normalization).params,
+        "points": N_POINTS,
+    }
+
+    paths = [os.path.join(directory, file) for file in files]
+    stats = [os.stat(path) for path in paths]
+    entries = [
+        [file, st.st_mtime_ns, st.st_size, _mtime_ns(trajectory_path(path))]
+        for file, st, path in zip(files, stats, paths)
+    ]
+
+    cached = {}
+    data = None
+    cached_trajectories = None
+    try:
+        manifest = loads(manifest_path.read_text())
+        if manifest["params"] == params:
+            data = np.load(data_path, mmap_mode="r")
+            cached_trajectories = np.load(trajectories_path)
+            for i, entry in enumerate(manifest["entries"]):
+                cached[tuple(entry)] = i
+    except (OSError, ValueError, KeyError):
+        cached = {}
+
+    if data is not None and [tuple(entry) for entry in entries] == list(cached):
+        return list(data), list(cached_trajectories)
+
+    images = np.zeros([len(files), size, size], np.uint8)
+    trajectories = np.zeros([len(files), N_POINTS, 2], np.float32)
+    for i, entry in enumerate(entries):
+        index = cached.get(tuple(entry))
+        if index is not None:
+            images[i] = data[index]
+            trajectories[i] = cached_trajectories[index]
+        else:
+            images[i] = preprocess_symbol(paths[i], size, normalization)
+            trajectories[i] = load_trajectory(paths[i])
+
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        if manifest_path.exists():
+            manifest_path.unlink()
+        replace_file(data_path, lambda file: np.save(file, images))
+        replace_file(trajectories_path, lambda file: np.save(file, trajectories))
+        manifest = dumps({"params": params, "entries": entries}, indent=2)
+        replace_file(manifest_path, lambda file: file.write(manifest.encode()))
+    except OSError:
+        return list(images), list(trajectories)
+
+    try:
+        return list(np.load(data_path, mmap_mode="r")), list(trajectories)
+    except (OSError, ValueError):
+        return list(images), list(trajectories)
+
+
+class SymbolLibrary:
+    """The symbol set in use, changed while the detector is running
+
+    Every change makes a new version of the read_symbols dict, a published
+    version is never modified. `symbols` is the newest version at once, the
+    subscribers get each version, the path of its index file and its
+    normalization on a background thread, one version at a time and
+    skipping the versions a newer one overtook.
+    """
+
+    def __init__(self, directory, size, normalization=DEFAULT_NORMALIZATION):
+        self.directory = directory
+        self.size = size
+        self.normalization = normalization
+        self.symbols = read_symbols(directory, size, normalization)
+        self._subscribers: List[Callable] = list()
+        self._lock = Lock()
+        self._publish_lock = Lock()
+        self._generation = 0
+        self._version = 0
+
+    def subscribe(self, callback: Callable):
+        """Calls `callback(symbols, index_path, normalization)` with every new version"""
+        self._subscribers.append(callback)
+
+    def add(self, file_name) -> Thread:
+        """Preprocesses a new template file of the set, only that one"""
+        path = os.path.join(BASE_DIR, self.directory, file_name)
+        template = (
+            preprocess_symbol(path, self.size, self.normalization),
+            file_name,
+            load_trajectory(path),
+        )
+        with self._lock:
+            templates = [t for ts in self.symbols.values() for t in ts if t[1] != file_name]
+            templates.append(template)
+            templates.sort(key=lambda t: t[1])
+            version = self._set(_group(templates))
+        return self._publish_later(version)
+
+    def remove(self, file_name) -> Thread:
+        """Deletes a template file of the set with its trajectory"""
+        path = os.path.join(BASE_DIR, self.directory, file_name)
+        for file in (Path(path), Path(trajectory_path(path))):
+            try:
+                file.unlink()
+            except FileNotFoundError:
+                pass
+        with self._lock:
+            symbols = dict(self.symbols)
+            key = symbol_name(file_name)
+            templates = [t for t in symbols.get(key, []) if t[1] != file_name]
+            if templates:
+                symbols[key] = templates
+            else:
+                symbols.pop(key, None)
+            version = self._set(symbols)
+        return self._publish_later(version)
+
+    def switch(
+        self, directory, normalization=DEFAULT_NORMALIZATION, on_loaded: Callable = None
+    ) -> Thread:
+        """Loads another symbol set in the background and publishes it,
+        unless a later switch overtook it"""
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+        thread = Thread(
+            target=self._load,
+            args=(directory, normalization, generation, on_loaded),
+            daemon=True,
+        )
+        thread.start()
+        return thread
+
+    def _load(self, directory, normalization, generation, on_loaded):
+        try:
+            symbols = read_symbols(directory, self.size, normalization)
+        except OSError as error:
+            print(f"Symbol set not loaded: {error}")
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            self.directory = directory
+            self.normalization = normalization
+            version = self._set(symbols)
+        self._publish(version)
+        if on_loaded:
+            on_loaded()
+
+    def _set(self, symbols):
+        """Makes `symbols` the newest version, called with the lock held"""
+        self.symbols = symbols
+        self._version += 1
+        index_path = get_cache_dir(self.directory) / INDEX_FILE
+        return self._version, symbols, index_path, self.normalization
+
+    def _publish_later(self, version) -> Thread:
+        thread = Thread(target=self._publish, args=(version,), daemon=True)
+        thread.start()
+        return thread
+
+    def _publish(self, version):
+        number, symbols, index_path, normalization = version
+        with self._publish_lock:
+            if number != self._version:
+                return
+            for callback in self._subscribers:
+                callback(symbols, index_path, normalization)
@@ -0,0 +1,158 @@
+"""Append-only binary recording of the pointer path
+
+A trace file is an 8 byte header followed by fixed size little-endian
+records of (time, kind, x, y). Every processed frame gives a POINT or a MISS
+record, every block sent to recognition a BLOCK record with the number of
+its points in x. A file cut off by a crash loses at most its last record.
+"""
+from asyncio import sleep
+from pathlib import Path
+from queue import Queue, Empty
+from threading import Thread, Lock
+from time import monotonic
+from typing import Iterator, List, Optional, Union
+
+import numpy as np
+
+MAGIC = b"SDTRACE\x01"
+RECORD = np.dtype([("time", "<f8"), ("kind", "u1"), ("x", "<i4"), ("y", "<i4")])
+MISS = 0
+POINT = 1
+BLOCK = 2
+TRACE_SUFFIX = ".sdt"
+
+
+class TraceWriter(Thread):
+    """Records into a preallocated buffer, a background thread appends the
+    filled buffers to the file, so recording never waits for the disk"""
+
+    def __init__(self, path: Union[Path, str], buffer_size=4096, flush_interval=1.0):
+        super().__init__(daemon=True)
+        self.path = Path(path)
+        self._buffer_size = buffer_size
+        self._flush_interval = flush_interval
+        self._buffer = np.zeros(buffer_size, RECORD)
+        self._count = 0
+        self._lock = Lock()
+        self._full: Queue = Queue()
+        self._running = False
+        self._started_at = monotonic()
+        self.records = 0
+
+    def start(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("wb") as file:
+            file.write(MAGIC)
+        self._started_at = monotonic()
+        self._running = True
+        super().start()
+
+    def frame(self, point):
+        """Records the result of capture_point, (found, [x, y]) or (False, 0)"""
+        if point[0]:
+            self._append(POINT, point[1][0], point[1][1])
+        else:
+            self._append(MISS, 0, 0)
+
+    def block(self, n_points: int):
+        self._append(BLOCK, n_points, 0)
+
+    def _append(self, kind, x, y):
+        with self._lock:
+            self._buffer[self._count] = (monotonic() - self._started_at, kind, x, y)
+            self._count += 1
+            self.records += 1
+            if self._count == self._buffer_size:
+                self._swap()
+
+    def _swap(self):
+        if self._count:
+            self._full.put(self._buffer[: self._count])
+            self._buffer = np.zeros(self._buffer_size, RECORD)
+            self._count = 0
+
+    def run(self):
+        with self.path.open("ab") as file:
+            while self._running or not self._full.empty():
+                try:
+                    records = self._full.get(timeout=self._flush_interval)
+                except Empty:
+                    with self._lock:
+                        self._swap()
+                    continue
+                file.write(records.tobytes())
+                file.flush()
+
+    def close(self):
+        with self._lock:
+            self._swap()
+        self._running = False
+        if self.is_alive():
+            self.join()
+
+
+class TraceReader:
+    """Memory-mapped records of a trace file"""
+
+    def __init__(self, path: Union[Path, str]):
+        self.path = Path(path)
+        with self.path.open("rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} is not a trace file")
+        count = (self.path.stat().st_size - len(MAGIC)) // RECORD.itemsize
+        if count:
+            self.records = np.memmap(self.path, RECORD, "r", len(MAGIC), (count,))
+        else:
+            self.records = np.zeros(0, RECORD)
+
+    def __len__(self):
+        return len(self.records)
+
+    def points(self) -> np.ndarray:
+        """x, y of every POINT record"""
+        points = self.records[self.records["kind"] == POINT]
+        return np.stack([points["x"], points["y"]], axis=1)
+
+    def blocks(self) -> Iterator[np.ndarray]:
+        """Points of the recorded blocks, the last BLOCK-many POINTs before each"""
+        kinds = self.records["kind"]
+        is_point = kinds == POINT
+        point_indices = np.flatnonzero(is_point)
+        seen = np.cumsum(is_point)
+        for i in np.flatnonzero(kinds == BLOCK):
+            # The POINTs before the BLOCK record are the first `end` point indices
+            end = int(seen[i])
+            n = int(self.records["x"][i])
+            chosen = point_indices[max(0, end - n): end]
+            yield np.stack([self.records["x"][chosen], self.records["y"][chosen]], axis=1)
+
+    async def replay(self, processor, speed=1.0):
+        """Feeds the frames into processor.analyze_point, at the recorded pace
+        divided by `speed`, or as fast as possible with 0"""
+        started = monotonic()
+        for time, kind, x, y in self.records.tolist():
+            if kind == BLOCK:
+                continue
+            if speed > 0:
+                await sleep(max(0.0, time / speed - (monotonic() - started)))
+            await processor.analyze_point((True, [x, y]) if kind == POINT else (False, 0))
+        await processor.wait_detections()
+
+    async def replay_blocks(self, process, speed=0.0) -> List[object]:
+        """Calls `process(points)` with every recorded block, returns the results"""
+        started = monotonic()
+        times = self.records["time"][self.records["kind"] == BLOCK]
+        results = list()
+        for time, points in zip(times.tolist(), self.blocks()):
+            if speed > 0:
+                await sleep(max(0.0, time / speed - (monotonic() - started)))
+            results.append(await process(points.tolist()))
+        return results
+
+
+def trace_path_for(path: Union[Path, str], source: Optional[str]) -> Path:
+    """The trace file of a source, <stem>-<source><suffix> if there are several"""
+    path = Path(path)
+    if not source:
+        return path
+    return path.with_name(f"{path.stem}-{source}{path.suffix or TRACE_SUFFIX}")
@@ -0,0 +1,126 @@
+"""Recognition of point blocks without rasterizing them
+
+The path is resampled to N_POINTS points equally spaced along its length,
+centered and scaled to unit size, then compared with every template as a
+point cloud, so neither the drawing direction nor the stroke order matters.
+"""
+import os
+
+import cv2.cv2 as cv2
+import numpy as np
+
+N_POINTS = 32
+TRAJECTORY_SUFFIX = ".npy"
+
+
+def resample(points, n=N_POINTS):
+    """n points equally spaced along the path"""
+    pts = np.asarray(points, np.float32).reshape(-1, 2)
+    steps = np.sqrt((np.diff(pts, axis=0) ** 2).sum(axis=1))
+    lengths = np.concatenate([[0.0], np.cumsum(steps)])
+    if lengths[-1] == 0.0:
+        return np.repeat(pts[:1], n, axis=0)
+    targets = np.linspace(0.0, lengths[-1], n)
+    x = np.interp(targets, lengths, pts[:, 0])
+    y = np.interp(targets, lengths, pts[:, 1])
+    return np.stack([x, y], axis=1).astype(np.float32)
+
+
+def normalize(points):
+    """Centers the points on their centroid and scales the larger side to 1"""
+    pts = points - points.mean(axis=0)
+    extent = float((pts.max(axis=0) - pts.min(axis=0)).max())
+    if extent > 0.0:
+        pts = pts / extent
+    return pts.astype(np.float32)
+
+
+def make_trajectory(points, n=N_POINTS):
+    return normalize(resample(points, n))
+
+
+def trajectory_from_image(gray_image, n=N_POINTS):
+    """Spreads n points over the drawn pixels by farthest point sampling,
+    for templates saved without their path"""
+    ys, xs = np.nonzero(gray_image)
+    pixels = np.stack([xs, ys], axis=1).astype(np.float32)
+    if len(pixels) == 0:
+        return np.zeros([n, 2], np.float32)
+    chosen = np.empty([n, 2], np.float32)
+    chosen[0] = pixels[np.argmin(pixels.sum(axis=1))]
+    dists = ((pixels - chosen[0]) ** 2).sum(axis=1)
+    for i in range(1, n):
+        chosen[i] = pixels[dists.argmax()]
+        dists = np.minimum(dists, ((pixels - chosen[i]) ** 2).sum(axis=1))
+    return normalize(chosen)
+
+
+def trajectory_path(image_path):
+    return os.path.splitext(image_path)[0] + TRAJECTORY_SUFFIX
+
+
+def save_trajectory(image_path, points):
+    """Saves the path of a drawing next to its image"""
+    np.save(trajectory_path(image_path), make_trajectory(points))
+
+
+def load_trajectory(image_path, n=N_POINTS):
+    """Trajectory saved next to the image, or derived from the image"""
+    try:
+        trajectory = np.load(trajectory_path(image_path))
+        if trajectory.shape == (n, 2):
+            return trajectory.astype(np.float32)
+    except (OSError, ValueError):
+        pass
+    return trajectory_from_image(cv2.imread(image_path, cv2.IMREAD_GRAYSCALE), n)
+
+
+class TrajectoryMatcher:
+    """Scores a path against the trajectories of every template of a symbol set at once"""
+
+    def __init__(self, symbols, n=N_POINTS):
+        self.labels = list()
+        self.images = list()
+        trajectories = list()
+        for k in symbols.keys():
+            for t in symbols[k]:
+                self.labels.append(k)
+                self.images.append(t[0])
+                trajectories.append(t[2])
+        self.n = n
+        if trajectories:
+            self.templates = np.stack(trajectories).astype(np.float32)
+        else:
+            self.templates = np.zeros([0, n, 2], np.float32)
+        # [x, y, x² + y², 1] rows, a product with [-2x', -2y', 1, x'² + y'²]
+        # gives the squared distances of every template point to every query point
+        flat = self.templates.reshape(-1, 2)
+        self._augmented = np.concatenate(
+            [flat, (flat ** 2).sum(axis=1, keepdims=True), np.ones([len(flat), 1], np.float32)],
+            axis=1,
+        )
+        self._augmented_t = np.ascontiguousarray(self._augmented.T)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def distances(self, points):
+        """Relative error (% of the symbol size) against every template:
+        the mean distance of the points to the nearest template point and back"""
+        query = make_trajectory(points, self.n)
+        query = np.concatenate(
+            [-2.0 * query, np.ones([self.n, 1], np.float32), (query ** 2).sum(axis=1, keepdims=True)],
+            axis=1,
+        )
+        # Both reductions run across rows, which is much faster than along short rows
+        to_query = (self._augmented @ query.T).reshape(len(self), self.n, self.n).min(axis=1)
+        to_template = (query @ self._augmented_t).min(axis=0).reshape(len(self), self.n)
+        np.maximum(to_query, 0.0, out=to_query)
+        np.maximum(to_template, 0.0, out=to_template)
+        return 50.0 * (np.sqrt(to_query).mean(axis=1) + np.sqrt(to_template).mean(axis=1))
+
+    def best(self, points):
+        """(index, relative error) of the best template"""
+        diffs = self.distances(points)
+        index = int(diffs.argmin())
+        return index, float(diffs[index])
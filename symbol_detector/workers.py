@@ -1,14 +1,25 @@
-from asyncio import sleep, create_task, run, Task
+from asyncio import sleep, create_task, run, Task, gather, get_running_loop
 from queue import Queue
 from threading import Thread
-from typing import Optional
+from time import perf_counter
+from typing import Dict, Optional
 
 import cv2.cv2 as cv2
 import numpy as np
 
-from symbol_detector.core import FilterProperty, filter_image, get_center, copy_drawing, draw_lines, \
-    resize_to_standard, ceil_blur, compare_cos
-from symbol_detector.settings import config
+from symbol_detector.backends import RecognitionBackend, TRAJECTORY
+from symbol_detector.capture import FrameGrabber
+from symbol_detector.channels import PreviewChannel
+from symbol_detector.core import FilterProperty, Segmenter, get_center, draw_drawing, draw_standard
+from symbol_detector.incremental import IncrementalRecognizer
+from symbol_detector.metrics import Metrics
+from symbol_detector.normalization import DEFAULT_NORMALIZATION, normalization_for
+from symbol_detector.pacing import FramePacer
+from symbol_detector.settings import ConfigSnapshot, config
+from symbol_detector.sources import FrameSource, CameraSource
+from symbol_detector.symbols import INDEX_FILE, get_cache_dir
+from symbol_detector.traces import TraceWriter
+from symbol_detector.trajectory import save_trajectory
 
 
 class BaseWorker:
@@ -16,6 +27,7 @@ class BaseWorker:
         self._running = False
         self._finished = True
         self._task: Optional[Task] = None
+        self._thread: Optional[Thread] = None
 
     def loop_start(self, *args, **kwargs):
         if self._running or not self._finished:
@@ -27,7 +39,18 @@ class BaseWorker:
         try:
             self._task = create_task(coroutine)
         except RuntimeError:
-            Thread(target=run, kwargs={'main': coroutine}).start()
+            self._thread = Thread(target=run, kwargs={'main': coroutine})
+            self._thread.start()
+
+    def thread_start(self, *args, **kwargs):
+        """Runs the worker on its own thread and event loop, even if a loop is running"""
+        if self._running or not self._finished:
+            return
+        self._running = True
+        self._finished = False
+        self._task = None
+        self._thread = Thread(target=run, kwargs={'main': self.run(*args, **kwargs)})
+        self._thread.start()
 
     def loop_stop(self):
         self._running = False
@@ -35,6 +58,12 @@ class BaseWorker:
     def run_end(self):
         self._finished = True
 
+    async def join(self):
+        if self._task:
+            await self._task
+        elif self._thread:
+            await get_running_loop().run_in_executor(None, self._thread.join)
+
     @property
     def running(self):
         return self._running
@@ -44,14 +73,30 @@ class BaseWorker:
 
 
 class FrameProcessor(BaseWorker):
-    _cam = None
-    shape = None
     """ Recording the pointer's x,y coordinates, forwarding the movement's path """
 
-    def __init__(self, callback_detect, out_queue: Queue = None):
+    def __init__(
+        self,
+        callback_detect,
+        preview: PreviewChannel = None,
+        source: FrameSource = None,
+        metrics: Metrics = None,
+        trace_path=None,
+        early: IncrementalRecognizer = None,
+    ):
         super().__init__()
         self._callback_detect = callback_detect
-        self._out_queue = out_queue
+        self._early = early
+        self._committed = False
+        self._trace_path = trace_path
+        self._trace: Optional[TraceWriter] = None
+        self._preview = preview
+        self._source = source if source is not None else CameraSource.from_config()
+        self.name = self._source.name
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.metrics.set_gauge("frames_dropped", lambda: self.dropped_frames)
+        self.metrics.set_gauge("detections_in_flight", lambda: len(self._detect_tasks))
+        self.shape = None
         self._filter_property = FilterProperty(
             y_min=config.y_min,
             y_max=config.y_max,
@@ -61,117 +106,358 @@ class FrameProcessor(BaseWorker):
             cr_max=config.cr_max,
             blur=config.blur,
         )
+        self._segmenter = Segmenter(self._filter_property)
+        self._window_segmenter = Segmenter(self._filter_property)
+        self._idle_segmenter = Segmenter(self._filter_property, config.pacing_idle_scale)
+        self._tracking = config.tracking
+        self._settings = config.snapshot()
+        self._last_center = None
+        self._velocity = 0
+        self.tracking_hits = 0
+        self.tracking_fallbacks = 0
         self._NBREAK = 10
         self._points = list()
         self._n_break = 0
-        self._sleep_time = 0.025
-        self._i = 0
-
-    @staticmethod
-    def init_camera():
-        FrameProcessor._cam = cv2.VideoCapture(config.camera_driver)
-        FrameProcessor._cam.set(cv2.CAP_PROP_AUTO_EXPOSURE, 1)
-        FrameProcessor._cam.set(cv2.CAP_PROP_EXPOSURE, config.camera_exposure)
-        FrameProcessor._cam.set(cv2.CAP_PROP_FRAME_WIDTH, config.camera_width)
-        FrameProcessor._cam.set(cv2.CAP_PROP_FRAME_HEIGHT, config.camera_height)
-        ret, frame = FrameProcessor._cam.read()
-        FrameProcessor.shape = frame.shape
-
-    @staticmethod
-    def release_camera():
-        if FrameProcessor._cam.isOpened():
-            FrameProcessor._cam.release()
+        self._pacer = FramePacer(
+            config.pacing_target_fps,
+            config.pacing_idle_fps,
+            config.pacing_idle_after,
+            config.pacing_idle_scale,
+            self.metrics,
+        )
+        self._detect_tasks = set()
+        self._grabber: Optional[FrameGrabber] = None
+        self._frame_seq = 0
+
+    def init_camera(self):
+        self._source.open()
+        self.shape = self._source.shape
+        if self._source.realtime:
+            self._grabber = FrameGrabber(self._source, metrics=self.metrics)
+            self._frame_seq = 0
+            self._grabber.start()
+
+    def release_camera(self):
+        if self._grabber:
+            self._grabber.stop()
+        self._source.release()
+
+    @property
+    def dropped_frames(self):
+        return self._grabber.dropped if self._grabber else 0
+
+    async def read_frame(self):
+        """Returns the newest frame, waiting for the capture thread if needed"""
+        if self._grabber is None:
+            with self.metrics.timer("camera_read"):
+                return self._source.read()
+        while True:
+            self._frame_seq, frame = self._grabber.latest(self._frame_seq)
+            if frame is not None:
+                return True, frame
+            if self._grabber.ended:
+                return False, None
+            await sleep(0.002)
+
+    def _apply_settings(self, settings: ConfigSnapshot):
+        """Takes over the filter, tracking and early decision settings"""
+        self._settings = settings
+        self._filter_property.load_from_settings(settings)
+        self._segmenter.update(self._filter_property)
+        self._window_segmenter.update(self._filter_property)
+        self._idle_segmenter.update(self._filter_property)
+        self._tracking = settings.tracking
+        if self._early:
+            self._early.max_error = settings.max_rel_error
+            self._early.margin = settings.early_margin
 
     async def run(self):
-        self._filter_property.load_from_settings(config)
+        self._apply_settings(config.snapshot())
+        self._last_center = None
         self.init_camera()
-        while self.running and self._cam.isOpened():
-            point = await self.capture_point()
-
-            if not point[0] and self._sleep_time == 0.025:
-                self._i += 1
-                if self._i == 200:
-                    self._sleep_time = 0.2
-            elif point[0]:
-                self._i = 0
-                self._sleep_time = 0.025
-
-            await self.analyze_point(point)
-            await sleep(self._sleep_time)
+        if self._trace_path:
+            self._trace = TraceWriter(self._trace_path)
+            self._trace.start()
+        self._pacer.reset()
+        while self.running and self._source.is_opened():
+            self._pacer.frame_started()
+            settings = config.snapshot()
+            if settings is not self._settings:
+                self._apply_settings(settings)
+            point = await self.capture_point(self._pacer.scale)
+            if point is None:
+                break
+            self._pacer.frame_done(point[0])
+            if self._trace:
+                self._trace.frame(point)
+
+            with self.metrics.timer("analyze_point"):
+                await self.analyze_point(point)
+            await sleep(self._pacer.delay() if self._source.realtime else 0)
+        if not self._source.is_opened() and len(self._points) > 3 and not self._committed:
+            self._detect(self._points)
+            self._points = list()
         self.release_camera()
+        if self._trace:
+            self._trace.close()
+            self._trace = None
+        await self.wait_detections()
         self.run_end()
 
-    async def capture_point(self):
-        is_point = False
-        point = 0
-        ret, frame = self._cam.read()
-        thresh = await filter_image(frame, self._filter_property)
-        mask = thresh > 0
-
-        if self._out_queue:
-            out = cv2.flip(frame, 1)
-            out[:, :, 0] *= mask
-            out[:, :, 1] *= mask
-            out[:, :, 2] *= mask
-            out = cv2.cvtColor(out, cv2.COLOR_BGR2RGBA)
-            self._out_queue.put(out)
-
-        cnts, hier = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+    async def wait_detections(self):
+        await gather(*self._detect_tasks)
+
+    async def capture_point(self, scale=1.0):
+        ret, frame = await self.read_frame()
+        if not ret:
+            return None
+
+        point = None
+        window = None
+        if scale < 1.0:
+            small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+            with self.metrics.timer("filter_image"):
+                thresh = self._idle_segmenter.apply(small)
+            point = await self._find_point(thresh, scale=scale)
+        elif self._tracking and self._last_center is not None:
+            window = self._search_window(frame.shape)
+            x0, y0, x1, y1 = window
+            width = frame.shape[1]
+            with self.metrics.timer("filter_image"):
+                thresh = self._window_segmenter.apply(frame[y0:y1, width - x1: width - x0])
+            point = await self._find_point(thresh, x0, y0)
+            if point:
+                self.tracking_hits += 1
+                self.metrics.increment("tracking_hits")
+            else:
+                self.tracking_fallbacks += 1
+                self.metrics.increment("tracking_fallbacks")
+        if point is None and scale >= 1.0:
+            window = None
+            with self.metrics.timer("filter_image"):
+                thresh = self._segmenter.apply(frame)
+            point = await self._find_point(thresh)
+
+        if self._preview and self._preview.wants_frame():
+            self._preview.put(self._render_preview(frame, thresh, window))
+
+        self._update_track(point)
+        self.metrics.increment("frames_processed")
+        if point:
+            return True, point
+        self.metrics.increment("frames_idle")
+        return False, 0
+
+    def _render_preview(self, frame, thresh, window):
+        """Masked, mirrored RGBA frame at preview size"""
+        width, height = self._preview.size
+        out = cv2.resize(frame, (width, height), interpolation=cv2.INTER_NEAREST)
+        out = cv2.flip(out, 1)
+        if window is None:
+            mask = cv2.resize(thresh, (width, height), interpolation=cv2.INTER_NEAREST)
+        else:
+            sx = width / frame.shape[1]
+            sy = height / frame.shape[0]
+            x0, y0 = int(window[0] * sx), int(window[1] * sy)
+            x1 = max(x0 + 1, int(window[2] * sx))
+            y1 = max(y0 + 1, int(window[3] * sy))
+            mask = np.zeros([height, width], np.uint8)
+            mask[y0:y1, x0:x1] = cv2.resize(
+                thresh, (x1 - x0, y1 - y0), interpolation=cv2.INTER_NEAREST
+            )
+        out = cv2.bitwise_and(out, out, mask=mask)
+        return cv2.cvtColor(out, cv2.COLOR_BGR2RGBA)
+
+    async def _find_point(self, thresh, dx=0, dy=0, scale=1.0):
+        point = None
+        started = perf_counter()
+        area_min = self._settings.area_min * scale ** 2
+        area_max = self._settings.area_max * scale ** 2
+        cnts, hier = cv2.findContours(
+            thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE, offset=(dx, dy)
+        )
         for i in range(len(cnts)):
             area = cv2.contourArea(cnts[i])
-            if (area > config.area_min) & (area < config.area_max):
+            if (area > area_min) & (area < area_max):
                 point = await get_center(cnts[i])
-                is_point = True
-        return is_point, point
+        self.metrics.observe("contours", perf_counter() - started)
+        if point and scale != 1.0:
+            point = [int(point[0] / scale), int(point[1] / scale)]
+        return point
+
+    def _update_track(self, point):
+        if point is None:
+            self._last_center = None
+            self._velocity = 0
+            return
+        if self._last_center is not None:
+            self._velocity = max(
+                abs(point[0] - self._last_center[0]), abs(point[1] - self._last_center[1])
+            )
+        self._last_center = point
+
+    def _search_window(self, shape):
+        """(x0, y0, x1, y1) around the last center in mirrored coordinates,
+        sized from the largest pointer and the recent velocity"""
+        radius = (self._settings.area_max / np.pi) ** 0.5
+        margin = self._filter_property.blur + 7
+        half = int(radius + 2 * self._velocity + margin)
+        half = (half + 15) // 16 * 16
+        cx, cy = self._last_center
+        return (
+            max(0, cx - half),
+            max(0, cy - half),
+            min(shape[1], cx + half),
+            min(shape[0], cy + half),
+        )
+
+    @property
+    def tracking_stats(self):
+        tries = self.tracking_hits + self.tracking_fallbacks
+        return {
+            "hits": self.tracking_hits,
+            "fallbacks": self.tracking_fallbacks,
+            "hit_rate": self.tracking_hits / tries if tries else 0.0,
+        }
 
     async def analyze_point(self, point):
-        if not point[0] and len(self._points) > 3:
+        if not point[0] and (len(self._points) > 3 or self._committed):
             self._n_break += 1
             if self._n_break == self._NBREAK:
-                _ = create_task(self._callback_detect(self._points))
+                if not self._committed:
+                    self._detect(self._points)
                 self._points = list()
                 self._n_break = 0
-        elif point[0]:
+                self._committed = False
+                if self._early:
+                    self._early.reset()
+        elif point[0] and not self._committed:
             self._points.append(point[1])
+            if self._early:
+                with self.metrics.timer("early_score"):
+                    ready = self._early.add(point[1])
+                if ready:
+                    # The rest of the stroke, until the pointer disappears, is dropped
+                    self.metrics.increment("early_commits")
+                    self._detect(self._points)
+                    self._committed = True
+
+    def _detect(self, points):
+        self.metrics.increment("blocks")
+        if self._trace:
+            self._trace.block(len(points))
+        task = create_task(self._callback_detect(points, self.name))
+        self._detect_tasks.add(task)
+        task.add_done_callback(self._detect_tasks.discard)
 
 
 class ShapeDetector:
-    """Recognition of shapes"""
+    """Recognition of shapes
+
+    The executor, the recognizer and the matcher options not given are read
+    from the settings whenever the backend is built.
+    """
 
     def __init__(
         self,
         symbols,
         image_size,
-        im_shape,
         ref_queue: Queue = None,
         result_queue: Queue = None,
         callback=None,
+        executor: str = None,
+        workers: int = None,
+        metrics: Metrics = None,
+        normalization: str = None,
+        tag_sources: bool = False,
+        recognizer: str = None,
+        cascade_size: int = None,
+        index_dims: int = None,
+        index_path=None,
     ):
         super().__init__()
-        self._im_shape = im_shape
+        self.metrics = metrics if metrics is not None else Metrics()
         self._callback = callback
+        self._tag_sources = tag_sources
         self._ref_queue = ref_queue
         self._result_queue = result_queue
-        self.symbols = symbols
+        self._executor = executor if executor is not None else config.executor
+        self._workers = workers if workers is not None else config.workers
+        self._recognizer = recognizer
+        self._cascade_size = cascade_size
+        self._index_dims = index_dims
         self.image_size = image_size
+        self.symbols = symbols
+        self._backend = self._make_backend(
+            symbols,
+            index_path if index_path is not None else get_cache_dir(config.symbol_set) / INDEX_FILE,
+            normalization or normalization_for(config.symbol_set, config.normalization),
+        )
+        self.matcher = self._backend.matcher
+        self.recognizer = self._backend.recognizer
         self.max_diff = (float(image_size) ** 2.0) * 255.0
-        self.current_image = None
+        # The last block of every source, the cameras share the detector
+        self.current_points: Dict[Optional[str], list] = {}
         self._running = False
+        if result_queue:
+            self.metrics.set_gauge("result_queue_depth", result_queue.qsize)
+        if ref_queue:
+            self.metrics.set_gauge("ref_queue_depth", ref_queue.qsize)
+
+    def _make_backend(self, symbols, index_path, normalization) -> RecognitionBackend:
+        return RecognitionBackend(
+            self._executor,
+            symbols,
+            self.image_size,
+            self._workers,
+            self._cascade_size if self._cascade_size is not None else config.cascade_size,
+            config.cascade_candidates,
+            self._recognizer if self._recognizer is not None else config.recognizer,
+            self._index_dims if self._index_dims is not None else config.index_dims,
+            index_path,
+            normalization,
+        )
+
+    def set_symbols(self, symbols, index_path=None, normalization=DEFAULT_NORMALIZATION):
+        """Switches to another version of the symbol library, the blocks
+        already in recognition finish with the previous one"""
+        backend = self._make_backend(symbols, index_path, normalization)
+        previous = self._backend
+        self.symbols = symbols
+        self.matcher = backend.matcher
+        self.recognizer = backend.recognizer
+        self._backend = backend
+        previous.shutdown()
 
-    def save_actual(self, filename):
-        im = copy_drawing(self.current_image)
+    def close(self):
+        self._backend.shutdown()
+
+    def save_actual(self, filename, source=None):
+        """Saves the last block recognized from `source`"""
+        points = self.current_points[source]
+        im = draw_drawing(points)
         cv2.imwrite(filename, im)
+        save_trajectory(filename, points)
 
-    async def process(self, points):
-        if len(points) < 3:
-            return
-        gray_image = np.zeros([self._im_shape[0], self._im_shape[1]], np.uint8)
-        await draw_lines(gray_image, points, 1)
-        self.current_image = gray_image.copy()
-        gray_image = resize_to_standard(gray_image, self.image_size)
-        gray_image = ceil_blur(gray_image, 15, 3)
-        typ, ref, diff = await compare_cos(gray_image, self.symbols)
-        recognized = diff < config.max_rel_error
+    async def process(self, points, source=None):
+        """Recognizes a block, returns (symbol, error, recognized)"""
+        backend = self._backend
+        if len(points) < 3 or not len(backend.matcher):
+            return None
+        self.current_points[source] = points
+        started = perf_counter()
+        index, diff, gray_image, timings = await backend.recognize(points)
+        self.metrics.observe("recognition", perf_counter() - started)
+        for stage, seconds in timings.items():
+            self.metrics.observe(stage, seconds)
+        typ, ref = backend.matcher.labels[index], backend.matcher.images[index]
+        print(diff)
+        settings = config.snapshot()
+        if backend.recognizer == TRAJECTORY:
+            recognized = diff < settings.max_trajectory_error
+        else:
+            recognized = diff < settings.max_rel_error
+        self.metrics.increment("symbols_recognized" if recognized else "symbols_rejected")
         if self._result_queue and recognized:
             im = np.zeros([ref.shape[0], ref.shape[1], 3], np.uint8)
             im[:, :, 1] = ref
@@ -181,9 +467,14 @@ class ShapeDetector:
             im[:, :, 0] = ref
             self._result_queue.put(im)
         if self._ref_queue:
+            if gray_image is None:
+                gray_image = draw_standard(points, self.image_size)
             current_im = cv2.cvtColor(gray_image, cv2.COLOR_GRAY2RGBA)
             self._ref_queue.put(current_im)
         if recognized:
             print(typ)
-            if self._callback:
+            if self._callback and self._tag_sources:
+                _ = create_task(self._callback(typ, source))
+            elif self._callback:
                 _ = create_task(self._callback(typ))
+        return typ, diff, recognized
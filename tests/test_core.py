@@ -0,0 +1,19 @@
+import numpy as np
+
+from symbol_detector.core import my_contour
+
+
+def test_my_contour_2d():
+    thresh = np.zeros([4, 5], np.uint8)
+    thresh[1, 2] = 255
+    thresh[3, 4] = 1
+    assert my_contour(thresh).tolist() == [[[2, 1], [4, 3]]]
+
+
+def test_my_contour_single_channel():
+    thresh = np.zeros([4, 5, 1], np.uint8)
+    thresh[1, 2] = 255
+    thresh[3, 4] = 1
+    contour = my_contour(thresh)
+    assert contour.shape == (1, 2, 2)
+    assert contour.tolist() == [[[2, 1], [4, 3]]]
@@ -0,0 +1,9 @@
+from types import SimpleNamespace
+
+from symbol_detector.detector import _make_names_unique
+
+
+def test_source_names_are_unique():
+    sources = [SimpleNamespace(name=name) for name in ("cam", "cam", "cam_1", "cam")]
+    _make_names_unique(sources)
+    assert [source.name for source in sources] == ["cam", "cam_2", "cam_1", "cam_3"]
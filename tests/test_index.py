@@ -0,0 +1,29 @@
+import numpy as np
+
+from symbol_detector.index import EmbeddingIndex
+
+
+def _index():
+    rng = np.random.default_rng(0)
+    templates = rng.random([40, 64]).astype(np.float32)
+    norms = np.sqrt((templates ** 2).sum(axis=1))
+    return EmbeddingIndex.fit(templates, norms, 8)
+
+
+def test_save_load(tmp_path):
+    path = tmp_path / "index.npz"
+    index = _index()
+    index.save(path, "key")
+    loaded = EmbeddingIndex.load(path, "key")
+    assert np.array_equal(loaded.embeddings, index.embeddings)
+    assert EmbeddingIndex.load(path, "other") is None
+    assert [p.name for p in tmp_path.iterdir()] == ["index.npz"]
+
+
+def test_truncated_index_is_a_miss(tmp_path):
+    path = tmp_path / "index.npz"
+    _index().save(path, "key")
+    data = path.read_bytes()
+    for size in (0, 10, len(data) // 2):
+        path.write_bytes(data[:size])
+        assert EmbeddingIndex.load(path, "key") is None
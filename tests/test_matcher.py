@@ -0,0 +1,22 @@
+import numpy as np
+
+from symbol_detector.benchmark import make_library, make_template
+from symbol_detector.matcher import TemplateMatcher
+
+
+def test_best_cos_apart_decides_like_the_exhaustive_search():
+    rng = np.random.default_rng(0)
+    symbols = make_library(400, rng)
+    exhaustive = TemplateMatcher(symbols)
+    matchers = [exhaustive, TemplateMatcher(symbols, 30, 16), TemplateMatcher(symbols, 0, 16, 32)]
+    labels = np.array(exhaustive.labels)
+    for _ in range(10):
+        im = make_template(rng)
+        diffs = exhaustive.cos_diffs(im)
+        best = int(diffs.argmin())
+        runner_up = diffs[labels != labels[best]].min()
+        for margin in (0.5, 5.0):
+            for matcher in matchers:
+                index, diff, other = matcher.best_cos_apart(im, margin)
+                assert labels[index] == labels[best]
+                assert (other - diff >= margin) == (runner_up - diffs[best] >= margin)
@@ -0,0 +1,34 @@
+from symbol_detector import pacing
+from symbol_detector.metrics import Metrics
+from symbol_detector.pacing import FramePacer
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def wake_up_latency(monkeypatch, idle_fps, appears_at=10.0):
+    """Runs a simulated loop at 40 fps which idles after 1 s, the pointer
+    appears at `appears_at` seconds"""
+    clock = Clock()
+    monkeypatch.setattr(pacing, "monotonic", clock)
+    metrics = Metrics()
+    pacer = FramePacer(40.0, idle_fps, 1.0, 0.5, metrics)
+    while clock.now < appears_at + 1.0:
+        pacer.frame_started()
+        clock.now += 0.001
+        pacer.frame_done(clock.now >= appears_at)
+        clock.now += pacer.delay()
+    return metrics.snapshot()["stages"]["wake_up"]
+
+
+def test_wake_up_covers_the_idle_period(monkeypatch):
+    slow = wake_up_latency(monkeypatch, 5.0)
+    fast = wake_up_latency(monkeypatch, 20.0)
+    assert slow["count"] == fast["count"] == 1
+    assert abs(slow["max"] - 0.2) < 1e-6
+    assert abs(fast["max"] - 0.05) < 1e-6